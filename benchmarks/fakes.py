@@ -0,0 +1,255 @@
+"""Lightweight stand-ins for the discord objects used by the voice listeners.
+
+REST calls are counted instead of being sent, and member moves made by the handlers are queued as new voice events."""
+
+from data.config import TAVERN_ID, BOT_ROLE, HYPERACTIVE_ROLES, REDIRECT_VOICE_CHANNEL, ROOMS_CATEGORY, MEMBERS_INFOCHANNEL, ONLINES_INFOCHANNEL
+from discord import ActivityType, Status
+from collections import Counter, deque
+import asyncio
+import itertools
+
+
+ids = itertools.count(10**17)
+
+
+class Rest:
+    """Counts the REST calls made by the handlers"""
+
+    def __init__(self):
+        self.calls = Counter()
+
+
+    async def call(self, route: str):
+        self.calls[route] += 1
+        await asyncio.sleep(0)
+
+
+    def total(self) -> int:
+        return sum(self.calls.values())
+
+
+
+class FakeRole:
+    def __init__(self, id: int, name: str):
+        self.id = id
+        self.name = name
+        self.mention = f"<@&{id}>"
+
+
+    def is_default(self) -> bool:
+        return self.name == "@everyone"
+
+
+
+class FakeActivity:
+    def __init__(self, name: str, type: ActivityType = ActivityType.playing):
+        self.name = name
+        self.type = type
+
+
+
+class FakeVoiceState:
+    def __init__(self, channel: "FakeVoiceChannel" = None, self_mute: bool = False):
+        self.channel = channel
+        self.self_mute = self_mute
+
+
+
+class FakeMember:
+    def __init__(self, guild: "FakeGuild", bot: bool = False):
+        self.id = next(ids)
+        self.guild = guild
+        self.bot = bot
+        self.name = self.display_name = f"member{self.id % 100000}"
+        self.nick = None
+        self.mention = f"<@{self.id}>"
+        self.status = Status.online
+        self.activities = ()
+        self.roles: list[FakeRole] = []
+        self.voice = FakeVoiceState()
+        self.created_at = self.joined_at = None
+
+
+    def __str__(self) -> str:
+        return self.name
+
+
+    async def move_to(self, channel, reason: str = None):
+        await self.guild.rest.call("move_member")
+        self.guild.set_voice(self, channel, queue=True)
+
+
+    async def add_roles(self, *roles, reason: str = None):
+        await self.guild.rest.call("add_role")
+        self.roles.extend(role for role in roles if role not in self.roles)
+
+
+    async def remove_roles(self, *roles, reason: str = None):
+        await self.guild.rest.call("remove_role")
+        self.roles = [role for role in self.roles if role not in roles]
+
+
+    async def edit(self, reason: str = None, **fields):
+        await self.guild.rest.call("edit_member")
+        for key, value in fields.items():
+            setattr(self, key, value)
+
+
+
+class FakeVoiceChannel:
+    def __init__(self, guild: "FakeGuild", name: str, category: "FakeCategory" = None, id: int = None):
+        self.id = id or next(ids)
+        self.guild = guild
+        self.name = name
+        self.category = category
+        self.members: list[FakeMember] = []
+        self.overwrites = {}
+        self.mention = f"<#{self.id}>"
+
+
+    async def edit(self, reason: str = None, **fields):
+        await self.guild.rest.call("edit_channel")
+        for key, value in fields.items():
+            setattr(self, key, value)
+
+
+    async def set_permissions(self, target, overwrite=None, reason: str = None, **permissions):
+        await self.guild.rest.call("set_permissions")
+
+
+    async def send(self, *args, **kwargs):
+        await self.guild.rest.call("send_message")
+
+
+    async def delete(self, reason: str = None):
+        await self.guild.rest.call("delete_channel")
+        self.guild.remove_channel(self)
+
+
+
+class FakeCategory:
+    def __init__(self, guild: "FakeGuild", id: int):
+        self.id = id
+        self.guild = guild
+        self.channels: list[FakeVoiceChannel] = []
+
+
+    @property
+    def voice_channels(self) -> list[FakeVoiceChannel]:
+        return self.channels
+
+
+    async def create_voice_channel(self, name: str, overwrites: dict = None, reason: str = None) -> FakeVoiceChannel:
+        await self.guild.rest.call("create_channel")
+        channel = FakeVoiceChannel(self.guild, name, self)
+        channel.overwrites = overwrites or {}
+        self.guild.add_channel(channel)
+        return channel
+
+
+
+class FakeGuild:
+    def __init__(self, rest: Rest, members: int, channels: int, id: int = TAVERN_ID):
+        self.id = id
+        self.rest = rest
+        self.events: deque[tuple] = deque()
+        """Voice events caused by the handlers, waiting to be dispatched"""
+
+        self.channels: dict[int, object] = {}
+        self.default_role = FakeRole(id, "@everyone")
+        self.roles = [self.default_role, FakeRole(BOT_ROLE, "Bots"), FakeRole(next(ids), "Muted")]
+        self.roles += [FakeRole(id, f"Hyperactif {level}") for level, id in enumerate(HYPERACTIVE_ROLES) if id]
+        self.roles_by_id = {role.id: role for role in self.roles}
+
+        self.rooms_category = FakeCategory(self, ROOMS_CATEGORY)
+        self.channels[ROOMS_CATEGORY] = self.rooms_category
+        self.redirect = self.add_channel(FakeVoiceChannel(self, "Créer une room", id=REDIRECT_VOICE_CHANNEL))
+        self.infochannels = [self.add_channel(FakeVoiceChannel(self, "Membres", id=MEMBERS_INFOCHANNEL)), self.add_channel(FakeVoiceChannel(self, "En ligne", id=ONLINES_INFOCHANNEL))]
+        self.voice_channels = [self.add_channel(FakeVoiceChannel(self, f"Vocal {i}")) for i in range(channels)]
+
+        self.members = [FakeMember(self) for _ in range(members)]
+        self.members_by_id = {member.id: member for member in self.members}
+
+
+    def add_channel(self, channel):
+        self.channels[channel.id] = channel
+        if channel.category:
+            channel.category.channels.append(channel)
+        return channel
+
+
+    def remove_channel(self, channel):
+        self.channels.pop(channel.id, None)
+        if channel.category and channel in channel.category.channels:
+            channel.category.channels.remove(channel)
+
+
+    def add_member(self) -> FakeMember:
+        member = FakeMember(self)
+        self.members.append(member)
+        self.members_by_id[member.id] = member
+        return member
+
+
+    def remove_member(self, member: FakeMember):
+        self.members.remove(member)
+        del self.members_by_id[member.id]
+
+
+    def get_member(self, id: int):
+        return self.members_by_id.get(id)
+
+
+    def get_channel(self, id: int):
+        return self.channels.get(id)
+
+
+    def get_role(self, id: int):
+        return self.roles_by_id.get(id)
+
+
+    def set_voice(self, member: FakeMember, channel: FakeVoiceChannel, self_mute: bool = None, queue: bool = False) -> tuple:
+        """Change a member's voice state and return the `(member, before, after)` event"""
+
+        before = member.voice
+        after = FakeVoiceState(channel, before.self_mute if self_mute is None else self_mute)
+
+        if before.channel and member in before.channel.members:
+            before.channel.members.remove(member)
+        if channel:
+            channel.members.append(member)
+
+        member.voice = after
+        event = (member, before, after)
+        if queue:
+            self.events.append(event)
+        return event
+
+
+
+class FakeBot:
+    def __init__(self, guild: FakeGuild):
+        self.guild = guild
+        self.guilds = [guild]
+        self.user = FakeMember(guild, bot=True)
+        self.loop = asyncio.get_running_loop()
+
+
+    def get_guild(self, id: int):
+        return self.guild if id == self.guild.id else None
+
+
+    def get_channel(self, id: int):
+        return self.guild.get_channel(id)
+
+
+    def is_ready(self) -> bool:
+        return True
+
+
+    async def wait_until_ready(self):
+        pass
+
+
+    def dispatch(self, event: str, *args):
+        pass
@@ -0,0 +1,93 @@
+"""Compare the leaderboard ranking engines on synthetic members.
+
+Run from the root directory: `python -m benchmarks.leaderboard [--sizes 10000 100000 1000000]`
+"""
+
+from resources.member_cache import MemberCache, top_rankings
+from cogs.hyperactive import BaseMemberData, streak_day
+from data.config import LEADERBOARD_LIMIT
+from time import perf_counter
+import datetime as dt
+import argparse
+import random
+
+
+def synthetic_documents(size: int, seed: int = 0) -> list[dict]:
+    """Documents shaped like the hyperactive collection, with times rounded to the minute so there are ties"""
+
+    rng = random.Random(seed)
+    now = dt.datetime.utcnow().timestamp()
+    return [
+        {
+            "_id": 100_000_000_000_000_000 + i,
+            "level": rng.randint(0, 5),
+            "time": rng.choice([0, 0, rng.randint(1, 600) / 60]),
+            "last": now - rng.uniform(0, 30 * 86400)
+        }
+        for i in range(size)
+    ]
+
+
+def legacy_rankings(documents: list[dict]) -> list[list[BaseMemberData]]:
+    """The previous `get_rankings()`, which inserted every member into a list of ranks"""
+
+    rankings: list[list[BaseMemberData]] = []
+
+    for result in documents:
+        result = dict(result)
+        id = result.pop("_id")
+        member_data = BaseMemberData(id, **result)
+
+        if member_data.time == 0 or (streak_day(member_data.now) - member_data.last) > dt.timedelta(weeks=1):
+            continue
+
+        for i, rank in enumerate(rankings):
+            if member_data.time == rank[0].time:
+                rankings[i].append(member_data)
+                break
+            elif member_data.time > rank[0].time:
+                rankings.insert(i, [member_data])
+                break
+        else:
+            rankings.append([member_data])
+
+    return rankings[:LEADERBOARD_LIMIT]
+
+
+def timed(func, *args) -> tuple[float, object]:
+    start = perf_counter()
+    result = func(*args)
+    return perf_counter() - start, result
+
+
+def run(size: int, legacy_limit: int):
+    documents = synthetic_documents(size)
+    since = (streak_day(dt.datetime.utcnow()) - dt.timedelta(weeks=1)).timestamp()
+    cache = MemberCache()
+
+    results = {}
+    results["cache load + index"], _ = timed(cache.load, documents)
+    results["bounded heap"], heap = timed(top_rankings, cache.times, cache.lasts, LEADERBOARD_LIMIT, since)
+    results["sorted index read"], index = timed(cache.rankings, LEADERBOARD_LIMIT, since)
+    results["index update"], _ = timed(lambda: [cache.set(id, 1, 1.5, since + 1) for id in cache.ids[:1000]])
+    results["index update"] /= 1000
+
+    if size <= legacy_limit:
+        results["legacy"], legacy = timed(legacy_rankings, documents)
+        assert [len(rank) for rank in legacy] == [len(rank) for rank in heap]
+
+    assert [len(rank) for rank in heap] == [len(rank) for rank in index]
+
+    print(f"{size:>9} members")
+    for name, duration in results.items():
+        print(f"    {name:<20} {duration * 1000:>10.3f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--legacy-limit", type=int, default=100_000, help="Skip the legacy function above this size")
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        run(size, args.legacy_limit)
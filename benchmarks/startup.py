@@ -0,0 +1,70 @@
+"""Measure the cold start of the bot, up to the moment it would connect to the gateway, offline.
+
+Each run is a fresh interpreter. Discord's login is simulated with a delay, once overlapping the import of the
+extensions (as the bot does) and once before them (as it used to).
+Run from the root directory: `python -m benchmarks.startup [--runs 5] [--login 0.3]`
+"""
+
+from time import perf_counter
+import subprocess
+import argparse
+import json
+import sys
+import os
+
+
+def child(mode: str, login: float):
+    os.environ["DATABASE"] = "mongomock://"
+    import asyncio
+    from contextlib import redirect_stdout
+    import io
+
+    with redirect_stdout(io.StringIO()):
+        import tavernier_main
+        from resources import perf
+
+        bot = tavernier_main.bot
+        if mode == "parallel":
+            bot.loop.run_until_complete(bot.prepare(asyncio.sleep(login)))
+        else:
+            bot.loop.run_until_complete(asyncio.sleep(login))
+            bot.loop.run_until_complete(bot.prepare(asyncio.sleep(0)))
+
+    perf.startup["ready"] = perf_counter() - tavernier_main.process_start
+    print(json.dumps(perf.startup))
+    sys.stdout.flush()
+    os._exit(0)  # The cogs' startup tasks wait for a gateway that never comes
+
+
+def run(mode: str, login: float) -> tuple[float, dict]:
+    start = perf_counter()
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.startup", "--child", mode, "--login", str(login)],
+        capture_output=True, text=True, check=True
+    ).stdout
+    return perf_counter() - start, json.loads(output.splitlines()[-1])
+
+
+def main(args):
+    for mode in ("sequential", "parallel"):
+        runs = [run(mode, args.login) for _ in range(args.runs)]
+        walls = sorted(wall for wall, _ in runs)
+        print(f"{mode}: median {walls[len(walls) // 2] * 1000:.0f} ms from process start (best {walls[0] * 1000:.0f} ms), login {args.login * 1000:.0f} ms")
+
+        # Phases of the median run
+        phases = sorted(runs, key=lambda run: run[0])[len(runs) // 2][1]
+        for name, duration in phases.items():
+            print(f"    {name:<32} {duration * 1000:>8.1f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--login", type=float, default=0.3, help="Simulated login duration, in seconds")
+    parser.add_argument("--child", choices=["sequential", "parallel"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.login)
+    else:
+        main(args)
@@ -0,0 +1,229 @@
+"""Replay synthetic voice, presence and member workloads through the listeners, offline.
+
+Reports the throughput, the p50/p99 latency of each handler, and the database operations and REST calls per event.
+The voice sessions ledger is not written to the in-memory database, its sessions and requests are estimated apart.
+Run from the root directory: `python -m benchmarks.voice_events [--members 2000] [--events 5000]`
+"""
+
+import os
+os.environ["DATABASE"] = "mongomock://"  # In-memory database, before anything connects
+
+from benchmarks.fakes import FakeActivity, FakeBot, FakeGuild, Rest
+from resources.voice_router import router
+from resources.sessions import ledger
+from discord import Status
+from contextlib import redirect_stdout
+from collections import defaultdict
+from time import perf_counter
+import argparse
+import asyncio
+import random
+import io
+
+import cogs.hyperactive as hyperactive
+import cogs.voice_room as voice_room
+import cogs.utilities as utilities
+import cogs.infochannels as infochannels
+
+
+GAMES = ["Minecraft", "Valorant", "Rocket League", "Factorio", "Outer Wilds"]
+
+
+class Harness:
+    def __init__(self, members: int, channels: int, seed: int):
+        self.rng = random.Random(seed)
+        self.rest = Rest()
+        self.guild = FakeGuild(self.rest, members, channels)
+        self.bot = FakeBot(self.guild)
+
+        cogs = [
+            hyperactive.Hyperactive(self.bot),
+            voice_room.VoiceRoom(self.bot),
+            utilities.Utilities(self.bot),
+            infochannels.MemberCount(self.bot),
+            infochannels.OnlineCount(self.bot)
+        ]
+        infochannels.counters.recount(self.guild)
+        self.presence_handlers = [cogs[1].on_presence_update, cogs[4].on_presence_update]
+        self.member_count = cogs[3]
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+
+
+    def db_operations(self) -> int:
+        return hyperactive.col.operations + voice_room.col.operations
+
+
+    async def call(self, handler, *args):
+        start = perf_counter()
+        await handler(*args)
+        self.latencies[handler.__qualname__].append(perf_counter() - start)
+
+
+    async def voice_event(self, member, before, after):
+        """Route a voice event, then the ones caused by the handlers (members moved by the bot)"""
+
+        self.guild.events.append((member, before, after))
+        while self.guild.events:
+            event, subscriptions = router.route(*self.guild.events.popleft())
+            for subscription in subscriptions:
+                await self.call(subscription.handler, event)
+
+
+    # - - - - Workloads - - - -
+
+    def voice_channels(self) -> list:
+        return self.guild.voice_channels + self.guild.rooms_category.channels
+
+
+    async def join(self):
+        member = self.rng.choice(self.guild.members)
+        if member.voice.channel:
+            return await self.leave(member)
+
+        channel = self.guild.redirect if self.rng.random() < 0.1 else self.rng.choice(self.voice_channels())
+        await self.voice_event(*self.guild.set_voice(member, channel))
+
+
+    async def leave(self, member=None):
+        member = member or self.rng.choice(self.guild.members)
+        if not member.voice.channel:
+            return await self.join()
+
+        await self.voice_event(*self.guild.set_voice(member, None))
+
+
+    async def move(self):
+        member = self.rng.choice(self.guild.members)
+        channel = self.rng.choice(self.voice_channels())
+        if not member.voice.channel or channel == member.voice.channel:
+            return await self.join()
+
+        await self.voice_event(*self.guild.set_voice(member, channel))
+
+
+    async def mute(self):
+        member = self.rng.choice(self.guild.members)
+        if not member.voice.channel:
+            return await self.join()
+
+        await self.voice_event(*self.guild.set_voice(member, member.voice.channel, not member.voice.self_mute))
+
+
+    async def member_join(self):
+        await self.call(self.member_count.on_member_join, self.guild.add_member())
+
+
+    async def member_remove(self):
+        # Members in voice stay, their voice events would be missing otherwise
+        member = self.rng.choice(self.guild.members)
+        if member.voice.channel:
+            return await self.member_join()
+
+        self.guild.remove_member(member)
+        await self.call(self.member_count.on_member_remove, member)
+
+
+    async def infochannel(self):
+        """A member entering an infochannel, who is moved back by the bot"""
+
+        member = self.rng.choice(self.guild.members)
+        if not member.voice.channel:
+            return await self.join()
+
+        await self.voice_event(*self.guild.set_voice(member, self.rng.choice(self.guild.infochannels)))
+
+
+    async def presence(self):
+        member = self.rng.choice(self.guild.members)
+        before = copy_presence(member)
+        member.status = self.rng.choice([Status.online, Status.idle, Status.dnd, Status.offline])
+        member.activities = (FakeActivity(self.rng.choice(GAMES)),) if self.rng.random() < 0.5 else ()
+
+        for handler in self.presence_handlers:
+            await self.call(handler, before, member)
+
+
+    async def warm_up(self, count: int):
+        """Put some members in voice so that leaves and moves have something to work with"""
+
+        for _ in range(count):
+            await self.join()
+        self.latencies.clear()
+        ledger.pending.clear()
+        router.counts.clear()
+
+
+    async def run(self, name: str, workload: list, events: int):
+        db, rest = self.db_operations(), self.rest.total()
+        start = perf_counter()
+
+        for _ in range(events):
+            await self.rng.choice(workload)()
+
+        duration = perf_counter() - start
+        # Writes are deferred, count them with the events that caused them
+        await hyperactive.buffer.flush()
+        # mongomock upserts get too slow to replay the rollups, the ledger is estimated instead of measured
+        sessions = len(ledger.pending)
+        ledger.pending.clear()
+
+        print(f"{name}: {events} events, {events / duration:,.0f} events/s")
+        print(f"    {(self.db_operations() - db) / events:.3f} database operations/event, {(self.rest.total() - rest) / events:.3f} REST calls/event")
+        print(f"    ledger (estimate): {sessions / events:.3f} sessions recorded/event, written with {2 if sessions else 0} requests at the next flush")
+        print("    routed:", ", ".join(f"{name} {count}" for name, count in router.counts.most_common()))
+        for handler, latencies in sorted(self.latencies.items()):
+            latencies.sort()
+            p50 = latencies[len(latencies) // 2] * 1e6
+            p99 = latencies[int(len(latencies) * 0.99)] * 1e6
+            print(f"    {handler:<40} p50 {p50:>8.1f} µs   p99 {p99:>8.1f} µs")
+
+        self.latencies.clear()
+        router.counts.clear()
+
+
+
+def copy_presence(member):
+    """Snapshot of the presence fields of a member, as the `before` argument of `on_presence_update`"""
+
+    copy = object.__new__(type(member))
+    copy.__dict__.update(member.__dict__)
+    return copy
+
+
+async def main(args):
+    harness = Harness(args.members, args.channels, args.seed)
+
+    with redirect_stdout(io.StringIO()):
+        await asyncio.sleep(0)  # Let the cogs load their data
+        await hyperactive.cache.loaded.wait()
+        await harness.warm_up(args.members // 4)
+
+    workloads = {
+        "join": [harness.join],
+        "leave": [harness.leave],
+        "move": [harness.move],
+        "mute": [harness.mute],
+        "presence": [harness.presence],
+        "members": [harness.member_join, harness.member_remove],
+        "infochannel": [harness.infochannel],
+        "mixed": [harness.join, harness.leave, harness.move, harness.mute, harness.member_join, harness.member_remove, harness.infochannel] + [harness.presence] * 6
+    }
+
+    for name, workload in workloads.items():
+        output = io.StringIO()
+        with redirect_stdout(output):
+            await harness.run(name, workload, args.events)
+        # Keep only the report, not the logs of the cogs
+        print("\n".join(line for line in output.getvalue().splitlines() if not line[:2].isdigit()))
+
+    for task in asyncio.all_tasks() - {asyncio.current_task()}:
+        task.cancel()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--members", type=int, default=2000)
+    parser.add_argument("--channels", type=int, default=20, help="Number of regular voice channels")
+    parser.add_argument("--events", type=int, default=5000, help="Number of events per workload")
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(main(parser.parse_args()))
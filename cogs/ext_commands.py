@@ -1,7 +1,11 @@
-from discord import Bot, Cog, SlashCommandGroup, ApplicationContext, AutocompleteContext, Embed, default_permissions, option
+from discord import Bot, Cog, SlashCommandGroup, ApplicationContext, AutocompleteContext, Embed, default_permissions, option, slash_command
 from discord.ext.commands import is_owner
+from data.config import PERF_TOP_LIMIT
 from typing import Union
 from resources.utils import log
+from resources.voice_router import router
+from resources.database import WriteBuffer, buffers
+from resources import perf
 import os
 
 
@@ -89,6 +93,52 @@ class ExtCommands(Cog):
         await ctx.respond(embed=embed)
 
 
+    @slash_command(name="perf")
+    @default_permissions(administrator=True)
+    @is_owner()
+    @option("reset", bool, description="Remettre les compteurs à zéro après l'affichage", default=False)
+    async def perf_cmd(self, ctx: ApplicationContext, reset: bool):
+        """Affiche les handlers les plus lents"""
+
+        lines = [f"{'handler':<40} {'appels':>7} {'moy.':>8} {'p99':>8} {'max':>8}"]
+
+        for name, histogram in perf.top(PERF_TOP_LIMIT):
+            values = [histogram.mean(), histogram.percentile(0.99), histogram.max]
+            lines.append(f"{name[:40]:<40} {histogram.count:>7} " + " ".join(f"{v * 1000:>6.1f}ms" for v in values))
+
+        embed = Embed(title="Performances", description="```\n" + "\n".join(lines) + "\n```")
+        voice_counts = [f"`{name}` {count}" for name, count in router.counts.most_common()]
+        # Presence updates dropped before any work because the member doesn't lead an auto-named room
+        if voice_room := self.bot.get_cog("VoiceRoom"):
+            voice_counts.append(f"`présences ignorées` {voice_room.skipped_presences}")
+        embed.add_field(name="Évènements vocaux", value="\n".join(voice_counts) or "aucun")
+
+        # Values to tune the flush interval and size of the write buffers
+        writes = []
+        for buffer in buffers:
+            if isinstance(buffer, WriteBuffer):
+                stats = buffer.stats()
+                writes.append(
+                    f"`{buffer.collection.name}` {stats['flushes']} écritures, {stats['written']} docs, {stats['pending']} en attente\n"
+                    f"dernière : {stats['last_batch']} docs en {stats['last_latency'] * 1000:.0f}ms (max {stats['max_latency'] * 1000:.0f}ms)"
+                )
+        if writes:
+            embed.add_field(name="Écritures différées", value="\n".join(writes), inline=False)
+
+        if perf.startup:
+            # Discord rejects field values over 1024 characters, the detailed report is printed in the console on startup
+            embed.add_field(name="Démarrage", value="```\n" + perf.startup_report(detailed=False) + "\n```", inline=False)
+
+        if reset:
+            perf.reset()
+            router.counts.clear()
+            if voice_room:
+                voice_room.skipped_presences = 0
+            embed.set_footer(text="Les compteurs ont été remis à zéro")
+
+        await ctx.respond(embed=embed, ephemeral=True)
+
+
 
 def setup(bot):
     bot.add_cog(ExtCommands(bot))
@@ -1,13 +1,25 @@
-from discord import Cog, Bot, Member, VoiceState, ApplicationContext, Embed, Color, slash_command, user_command, option, default_permissions
+from discord import Cog, Bot, Member, ApplicationContext, Embed, Color, slash_command, user_command, option, default_permissions
 from discord.ext.tasks import loop
-from data.config import HYPERACTIVE_DB_COLLECTION, HYPERACTIVE_WEEK_DAY, HYPERACTIVE_LEVELS, HYPERACTIVE_ROLES, REDIRECT_VOICE_CHANNEL, LEADERBOARD_CHANNEL, LEADERBOARD_LIMIT, CONSOLE_CHANNEL
-from resources.database import database
-from resources.utils import time2str, wait_until
+from data.config import DB_TIMEOUT, DB_RETRY_DELAY, DB_RETRY_MAX, TAVERN_ID, BOT_GUILDS, HYPERACTIVE_DB_COLLECTION, HYPERACTIVE_DB_STATE, HYPERACTIVE_WEEK_DAY, HYPERACTIVE_FLUSH_TIMER, HYPERACTIVE_FLUSH_SIZE, HYPERACTIVE_ROLE_WORKERS, HYPERACTIVE_LEVELS, HYPERACTIVE_ROLES, LEADERBOARD_CHANNEL, LEADERBOARD_LIMIT, CONSOLE_CHANNEL
+from resources.database import WriteBuffer, flush_all, get_collection
+from resources.member_cache import MemberCache, top_rankings
+from resources.queue import WorkQueue
+from resources.sessions import ledger
+from resources.voice_router import Transition, VoiceEvent, router
+from resources.utils import log, process_start, time2str
 import datetime as dt
+import asyncio
 import json
 
 
-col = database.get_collection(HYPERACTIVE_DB_COLLECTION)
+col = get_collection(HYPERACTIVE_DB_COLLECTION)
+state = get_collection(HYPERACTIVE_DB_STATE)
+buffer = WriteBuffer(col, HYPERACTIVE_FLUSH_TIMER, HYPERACTIVE_FLUSH_SIZE)
+cache = MemberCache()
+role_queue = WorkQueue("Hyperactive roles", HYPERACTIVE_ROLE_WORKERS)
+hyperactive_roles = set(filter(None, HYPERACTIVE_ROLES))
+level_hours = [time / dt.timedelta(hours=1) for time in HYPERACTIVE_LEVELS]
+WEEK = dt.timedelta(weeks=1).total_seconds()
 
 
 class BaseMemberData:
@@ -31,7 +43,7 @@ class BaseMemberData:
         if self.last.timestamp() == 0:
             return False
 
-        return streak_day(self.now) >= self.last
+        return streak_day(self.now) > self.last
 
 
     def reached(self) -> bool:
@@ -44,21 +56,9 @@ class BaseMemberData:
         """Returns the new level of the member based on his time and current level"""
 
         diff = streak_day(self.now) - self.last
-        if diff > dt.timedelta(days=7):
-            # If the member last connected more than a week ago, subtract the right amount of levels
-            weeks = diff // dt.timedelta(days=7)
-            return max(0, self.level - weeks)
-
-        elif self.level+1 < len(HYPERACTIVE_LEVELS) and self.time >= HYPERACTIVE_LEVELS[self.level+1]:
-            # If the time matches the requirement for the next level
-            return self.level + 1
-
-        elif self.level-1 >= 0 and self.time < HYPERACTIVE_LEVELS[self.level-1]:
-            # If the time doesn't matches the requirement for the current level
-            return self.level - 1
-
-        else:
-            return self.level
+        # If the member last connected more than a week ago, subtract the right amount of levels
+        idle_weeks = diff // dt.timedelta(days=7) if diff > dt.timedelta(days=7) else 0
+        return next_level(self.level, self.time / dt.timedelta(hours=1), idle_weeks)
 
 
     def display_level(self) -> int:
@@ -92,37 +92,42 @@ class MemberData(BaseMemberData):
 
 
     def commit(self):
-        """Push member data into the database"""
+        """Update the cache and queue member data to be pushed into the database with the next flush"""
 
         data = {
             "level": self.level,
             "time": self.time / dt.timedelta(hours=1),  # Convert into hours
             "last": self.last.timestamp()
         }
-        col.update_one({"_id": self.member.id}, {"$set": data}, upsert=True)
+        cache.set(self.member.id, **data)
+        buffer.set(self.member.id, data)
 
 
-    async def update_role(self):
-        new_role = self.member.guild.get_role(HYPERACTIVE_ROLES[self.display_level()])
+    def update_role(self):
+        """Queue the update of the member's hyperactive role. Only the last queued level of a member is applied"""
 
-        for role in self.member.roles:
-            if role.id in HYPERACTIVE_ROLES:
-                await self.member.remove_roles(role)
+        member, level = self.member, self.display_level()
+        role_queue.submit(member.id, lambda: reconcile_roles(member, level))
 
-        if new_role:
-            await self.member.add_roles(new_role)
 
+    def start_week(self):
+        """Apply the level of the past week and start the new one, when the member comes back after the reset day"""
 
-    async def handle_midnight(self):
+        self.level = self.new_level()
+        self.time = dt.timedelta(0)
+        self.update_role()
+
+
+    def handle_midnight(self):
         """Handle the case where a member connected before and left after midnight on reset day"""
 
         day = streak_day(self.now)
         self.time += day - self.last
-        await self.update_role()
+        self.update_role()
 
         self.time = self.now - day
         if self.reached():
-            await self.update_role()
+            self.update_role()
 
 
 
@@ -130,11 +135,77 @@ class MemberData(BaseMemberData):
 
 
 
-def get_data(member: Member) -> MemberData:
-    """Get a member's data from the database"""
+def next_level(level: int, hours: float, idle_weeks: int) -> int:
+    """Return the level of a member at the end of a week from the hours of the week and the number of weeks without activity"""
+
+    if idle_weeks:
+        return max(0, level - idle_weeks)
+
+    elif level+1 < len(level_hours) and hours >= level_hours[level+1]:
+        # If the time matches the requirement for the next level
+        return level + 1
+
+    elif level-1 >= 0 and hours < level_hours[level-1]:
+        # If the time doesn't matches the requirement for the current level
+        return level - 1
+
+    else:
+        return level
+
+
+async def get_data(member: Member) -> MemberData:
+    """Get a member's data from the cache, or from the database if the cache takes too long to load"""
+
+    if not cache.loaded.is_set() and member.id not in cache:
+        try:
+            await asyncio.wait_for(cache.loaded.wait(), DB_TIMEOUT.total_seconds())
+        except asyncio.TimeoutError:
+            doc = (await col.find_one({"_id": member.id}) or {}) | buffer.get(member.id)
+            return MemberData(member, doc.get("level", 0), doc.get("time", 0), doc.get("last", 0))
+
+    return MemberData(member, *(cache.get(member.id) or ()))
 
-    result = col.find_one({"_id": member.id}, {"_id": 0}) or {}
-    return MemberData(member, **result)
+
+async def load_cache():
+    """Fill the cache with the whole hyperactive collection, trying again until it works"""
+
+    delay = DB_RETRY_DELAY
+
+    while True:
+        try:
+            # A previous instance of the cog may still be writing its last updates
+            if not await flush_all(col):
+                raise RuntimeError("the pending updates could not be written")
+            documents = await col.find_all()
+            break
+        except Exception as e:
+            log(f"Hyperactive cache loading failed, next try in {time2str(delay)}:", repr(e))
+            await asyncio.sleep(delay.total_seconds())
+            delay = min(delay * 2, DB_RETRY_MAX)
+
+    cache.load(documents)
+    log(f"Hyperactive cache loaded ({len(cache)} members)")
+
+
+def target_roles(member: Member, level: int) -> list:
+    """Return the roles a member should have for a hyperactive level, or None if they already have them"""
+
+    role = member.guild.get_role(HYPERACTIVE_ROLES[level])
+    current = {r.id for r in member.roles if r.id in hyperactive_roles}
+    if current == ({role.id} if role else set()):
+        return None
+
+    roles = [r for r in member.roles if r.id not in hyperactive_roles and not r.is_default()]
+    return roles + [role] if role else roles
+
+
+async def reconcile_roles(member: Member, level: int):
+    """Give a member the role of their level and remove the other hyperactive roles, in a single request"""
+
+    # Computed when the job runs, from the member's latest roles
+    roles = target_roles(member, level)
+    if roles is not None:
+        await member.edit(roles=roles, reason="Niveau hyperactif")
 
 
 def streak_day(now: dt.date = None) -> dt.datetime:
@@ -146,20 +217,51 @@ def streak_day(now: dt.date = None) -> dt.datetime:
     return full
 
 
-def false_alert(member: Member, before: VoiceState, after: VoiceState) -> bool:
-    """Return if an `on_voice_state_update` event has been triggered in unwanted circumstances"""
+async def last_reset() -> dt.datetime:
+    """Return the last weekly boundary whose reset was made, `datetime.min` if there is none"""
+
+    doc = await state.find_one({"_id": "weekly_reset"})
+    return dt.datetime.fromtimestamp(doc["boundary"]) if doc else dt.datetime.min
+
 
-    return any([
-        # If the member is a bot
-        member.bot,
-        # If the left and joined channel are both None
-        not before.channel and not after.channel,
-        # If the channel left is the redirect voice channel
-        getattr(before.channel, "id", None) == REDIRECT_VOICE_CHANNEL,
-        # If the channel left is the same as the channel joined
-        before.channel == after.channel
-    ])
+def reset_week(boundary: dt.datetime, in_voice: dict[int, int], rank_limit: int) -> tuple[list[list[BaseMemberData]], dict[int, int]]:
+    """Close the week ending at `boundary` for every member, in one pass over the cache.
+    Return the final rankings of the week, and the new level of each member whose data changed"""
 
+    end = boundary.timestamp()
+    ids, levels = cache.ids, cache.levels
+    # Members still in voice get the time spent before the boundary, the rest goes to the new week
+    times = [time + (end - last) / 3600 if id in in_voice and last < end else time for id, time, last in zip(ids, cache.times, cache.lasts)]
+    lasts = [end if id in in_voice else last for id, last in zip(ids, cache.lasts)]
+
+    # Time already counted in the new week is left out of the final rankings
+    week_times = [time if last < end else 0 for time, last in zip(times, cache.lasts)]
+    rankings = [[BaseMemberData(ids[row], levels[row], times[row], lasts[row]) for row in rank] for rank in top_rankings(week_times, lasts, rank_limit, end - WEEK)]
+
+    rows: dict[int, int] = {}
+    for row, (level, time, last) in enumerate(zip(levels, times, cache.lasts)):
+        # Already in the new week, or nothing left to decay
+        if last >= end or not (level or time):
+            continue
+
+        idle = 0 if ids[row] in in_voice else end - last
+        if time == 0:
+            # No activity during the week, even if the member was already reset at the previous boundary
+            idle_weeks = max(1, int(idle // WEEK))
+        else:
+            idle_weeks = int(idle // WEEK) if idle > WEEK else 0
+
+        rows[row] = next_level(level, time, idle_weeks)
+
+    # The last activity is moved to the boundary, so the next reset only counts the week after it
+    cache.reset_rows(rows, end)
+    buffer.set_many({ids[row]: {"level": level, "time": 0, "last": end} for row, level in rows.items()})
+
+    for rank in rankings:
+        for member_data in rank:
+            member_data.level = rows.get(cache.index[member_data.member_id], member_data.level)
+
+    return rankings, {ids[row]: level for row, level in rows.items()}
 
 
 class Hyperactive(Cog):
@@ -167,31 +269,153 @@ class Hyperactive(Cog):
 
     def __init__(self, bot):
         self.bot: Bot = bot
+        buffer.start(self.bot.loop)
+        ledger.start(self.bot.loop)
+        self.bot.loop.create_task(load_cache())
+        self.bot.loop.create_task(ledger.setup())
+        # A reloaded cog keeps the sessions of the cache, which was written by the previous instance
+        self.reconciled = self.bot.is_ready()
+        self.last_reset: dt.datetime = None
+        """Last weekly boundary whose reset was tried, read from the database when the loop starts"""
+        if self.bot.is_ready():
+            # Reloaded cog, on_ready won't be called again
+            self.reset_loop.start()
+
+        # Bots and mute toggles are never routed here, and leaving the redirect channel is not counted
+        router.subscribe(Transition.JOIN | Transition.LEAVE | Transition.MOVE, self.on_voice_update, exclude=Transition.LEFT_REDIRECT)
+
+
+    def cog_unload(self):
+        router.unsubscribe(self)
+        self.reset_loop.cancel()
+        role_queue.close()
+        # Don't lose the voice time tracked since the last flush
+        self.bot.loop.create_task(buffer.close())
+        # The ledger is shared with the next instance of the cog, it keeps its flush loop
+        self.bot.loop.create_task(ledger.try_flush())
+
+
+    @loop()
+    async def reset_loop(self):
+        boundary = streak_day(dt.datetime.utcnow())
+
+        if self.last_reset is None:
+            try:
+                self.last_reset = await last_reset()
+            except Exception as e:
+                # Resetting a week twice changes nothing, the members already reset are skipped
+                log("Hyperactive last weekly reset could not be read:", repr(e))
+                self.last_reset = dt.datetime.min
+
+        # A boundary passed while the bot was offline is reset right away, otherwise wait for the next one
+        if self.last_reset >= boundary:
+            boundary += dt.timedelta(weeks=1)
+            await asyncio.sleep((boundary - dt.datetime.utcnow()).total_seconds() + 1)
+
+        # A failed reset is made again on the next startup
+        self.last_reset = boundary
+        # An exception would stop the loop, and with it every following reset
+        try:
+            await self.weekly_reset(boundary)
+        except Exception as e:
+            log("Hyperactive weekly reset failed:", repr(e))
+
+
+    async def weekly_reset(self, boundary: dt.datetime):
+        """Compute the new levels of every member, write them in a single bulk write and queue the role changes.
+        The boundary is then recorded as reset"""
+
+        await cache.loaded.wait()
+        # The hyperactive data covers the members of every guild of the bot
+        guilds = filter(None, map(self.bot.get_guild, BOT_GUILDS))
+        in_voice = {member.id: channel.id for guild in guilds for channel in guild.voice_channels for member in channel.members if not member.bot}
+
+        # Sessions still running are split at the boundary, as their time is
+        for member_id, channel_id in in_voice.items():
+            data = cache.get(member_id)
+            if data and data[2] < boundary.timestamp():
+                ledger.record(member_id, channel_id, dt.datetime.fromtimestamp(data[2]), boundary)
+
+        rankings, levels = reset_week(boundary, in_voice, LEADERBOARD_LIMIT)
+        await buffer.flush()
+
+        # The hyperactive roles are those of the tavern
+        guild = self.bot.get_guild(TAVERN_ID)
+        queued = 0
+        for member_id, level in levels.items():
+            member = guild and guild.get_member(member_id)
+            if member and target_roles(member, level) is not None:
+                role_queue.submit(member.id, lambda member=member, level=level: reconcile_roles(member, level))
+                queued += 1
+
+        log(f"Hyperactive weekly reset: {len(levels)} members updated, {queued} role changes queued")
+        self.bot.dispatch("weekly_reset", rankings)
+        await state.update_one({"_id": "weekly_reset"}, {"$set": {"boundary": boundary.timestamp()}}, upsert=True)
+
+
+    async def reconcile_sessions(self):
+        """Restart the sessions of the members already in voice, whose events were missed while the bot was offline"""
+
+        await cache.loaded.wait()
+        now = dt.datetime.utcnow()
+        count = 0
+        # Members updated by this process have their sessions right
+        outage = process_start.timestamp()
+
+        for guild in filter(None, map(self.bot.get_guild, BOT_GUILDS)):
+            for channel in guild.voice_channels:
+                for member in channel.members:
+                    if member.bot:
+                        continue
+
+                    # The time spent while the bot was offline is unknown, it is not counted
+                    member_data = MemberData(member, *(cache.get(member.id) or ()))
+                    if member_data.last.timestamp() >= outage:
+                        continue
+
+                    member_data.now = now
+                    if member_data.expired():
+                        member_data.start_week()
+                    member_data.last = now
+                    member_data.commit()
+                    count += 1
+
+        await buffer.flush()
+        log(f"Hyperactive sessions reconciled for {count} members in voice")
 
 
     @Cog.listener()
-    async def on_voice_state_update(self, member: Member, before: VoiceState, after: VoiceState):
-        if false_alert(member, before, after):
-            return
+    async def on_ready(self):
+        if not self.reset_loop.is_running():
+            self.reset_loop.start()
+
+        # on_ready is also called when a new gateway session starts, the sessions are only restarted after a restart
+        if not self.reconciled:
+            self.reconciled = True
+            await self.reconcile_sessions()
 
-        member_data = get_data(member)
+
+    async def on_voice_update(self, event: VoiceEvent):
+        member, before, after = event.member, event.before, event.after
+        member_data = await get_data(member)
 
         # When a channel is left
         if before.channel and before.channel != after.channel:
+            if member_data.last.timestamp():
+                ledger.record(member.id, before.channel.id, member_data.last, member_data.now)
+
             if member_data.expired():
                 # Handle the case where a member connected before and left after midnight on reset day
-                await member_data.handle_midnight()
+                member_data.handle_midnight()
             else:
                 member_data.update_time()
 
             if member_data.reached():
-                await member_data.update_role()
+                member_data.update_role()
 
         # Or if the member last connected last week
         elif member_data.expired():
-            member_data.level = member_data.new_level()
-            member_data.time = dt.timedelta(0)
-            await member_data.update_role()
+            member_data.start_week()
 
         member_data.last = member_data.now
         member_data.commit()
@@ -204,7 +428,7 @@ class Hyperactive(Cog):
 
         await ctx.defer()
 
-        data = get_data(user or ctx.author)
+        data = await get_data(user or ctx.author)
         member = data.member
 
         embed = Embed(
@@ -241,27 +465,16 @@ class Hyperactive(Cog):
 # - - - - - - - - - - - Leaderboard - - - - - - - - - - -
 
 
-def get_rankings() -> list[list[BaseMemberData]]:
-    rankings: list[list[BaseMemberData]] = []
+async def get_rankings(rank_limit: int) -> list[list[BaseMemberData]]:
+    """Return the members of the `rank_limit` first ranks of the week, grouped by rank"""
 
-    for result in col.find():
-        id = result.pop("_id")
-        member_data = BaseMemberData(id, **result)
+    await cache.loaded.wait()
 
-        if member_data.time == 0 or (streak_day(member_data.now) - member_data.last) > dt.timedelta(weeks=1):
-            continue
+    # Members who last connected more than a week before the streak day are ignored
+    since = (streak_day(dt.datetime.utcnow()) - dt.timedelta(weeks=1)).timestamp()
+    rankings = cache.rankings(rank_limit, since)
 
-        for i, rank in enumerate(rankings):
-            if member_data.time == rank[0].time:
-                rankings[i].append(member_data)
-                break
-            elif member_data.time > rank[0].time:
-                rankings.insert(i, [member_data])
-                break
-        else:
-            rankings.append([member_data])
-
-    return rankings
+    return [[BaseMemberData(id, *cache.get(id)) for id in rank] for rank in rankings]
 
 
 def rank_emoji(rank: int) -> str:
@@ -290,10 +503,9 @@ def level_str(level: int) -> str:
         return "| niveau Ⅴ"
 
 
-def leaderboard_embed(rank_limit: int) -> Embed:
+def leaderboard_embed(rankings_list: list[list[BaseMemberData]]) -> Embed:
     """Return a Discord embed with the hyperactive leaderboard of the server"""
 
-    rankings_list = get_rankings()
     embed = Embed(
         title = "Classement d'activité",
         description = "Voici les membres les plus actifs en vocal sur la Taverne cette semaine.\nPetit rappel : pensez à vous hydrater et à toucher de l'herbe ;)\n\n",
@@ -301,9 +513,6 @@ def leaderboard_embed(rank_limit: int) -> Embed:
     )
 
     for i, rank in enumerate(rankings_list):
-        if i >= rank_limit:
-            break
-
         for member_data in rank:
             prefix = rank_emoji(i+1)
             mention = "<@" + str(member_data.member_id) + ">"
@@ -322,25 +531,16 @@ class Leaderboard(Cog):
         self.bot: Bot = bot
 
 
-    async def send_leaderboard(self):
+    async def send_leaderboard(self, rankings: list[list[BaseMemberData]]):
         channel = self.bot.get_channel(LEADERBOARD_CHANNEL)
-        embed = leaderboard_embed(LEADERBOARD_LIMIT)
-        await channel.send(embed=embed)
-
-
-    @loop()
-    async def leaderboard_loop(self):
-        now = dt.datetime.now()
-        next = streak_day(now) + dt.timedelta(weeks=1, seconds=1)
-        await wait_until(next)
-
-        await self.send_leaderboard()
+        await channel.send(embed=leaderboard_embed(rankings))
 
 
     @Cog.listener()
-    async def on_ready(self):
-        if not self.leaderboard_loop.is_running():
-            self.leaderboard_loop.start()
+    async def on_weekly_reset(self, rankings: list[list[BaseMemberData]]):
+        """Send the final rankings of the week which just ended"""
+
+        await self.send_leaderboard(rankings)
 
 
     @slash_command(name="leaderboard")
@@ -349,7 +549,10 @@ class Leaderboard(Cog):
     async def leaderboard_cmd(self, ctx: ApplicationContext, rank_limit: int = 10):
         """Affiche le classement des membres les plus actifs"""
 
-        embed = leaderboard_embed(rank_limit)
+        if not cache.loaded.is_set():
+            return await ctx.respond("Le classement est encore en cours de chargement, réessayez dans un instant.", ephemeral=True)
+
+        embed = leaderboard_embed(await get_rankings(rank_limit))
         await ctx.respond(embed=embed)
 
 
@@ -1,50 +1,109 @@
-from discord import Bot, Cog, Guild, Member, Status, VoiceChannel, VoiceState
-from data.config import TAVERN_ID, MEMBERS_INFOCHANNEL, ONLINES_INFOCHANNEL
+from discord import Bot, Cog, Guild, Member, Status, VoiceChannel
+from data.config import TAVERN_ID, MEMBERS_INFOCHANNEL, ONLINES_INFOCHANNEL, INFOCHANNELS_RECOUNT_TIMER
 from discord.ext import tasks
 from resources.utils import log
+from resources.renamer import renamer
+from resources.voice_router import Transition, VoiceEvent, router
+
+
+class MemberCounters:
+    """Number of human members in the server, and how many of them are online, dnd and idle"""
+
+    def __init__(self):
+        self.counted = False
+        """Whether the counters have been initialized with a full count"""
+        self.humans = 0
+        self.statuses = {Status.online: 0, Status.dnd: 0, Status.idle: 0}
+
+
+    def recount(self, guild: Guild):
+        """Count every member again, to correct any drift"""
+
+        self.humans = 0
+        self.statuses = dict.fromkeys(self.statuses, 0)
+
+        for member in guild.members:
+            self.add(member)
+
+        self.counted = True
+
+
+    def add(self, member: Member):
+        if not member.bot:
+            self.humans += 1
+            self.change_status(None, member.status)
+
+
+    def remove(self, member: Member):
+        if not member.bot:
+            self.humans -= 1
+            self.change_status(member.status, None)
+
+
+    def change_status(self, before: Status, after: Status):
+        if before in self.statuses:
+            self.statuses[before] -= 1
+        if after in self.statuses:
+            self.statuses[after] += 1
+
+
+    def members_name(self) -> str:
+        return f"Membres : {self.humans}"
+
+
+    def onlines_name(self) -> str:
+        return f"🟢 {self.statuses[Status.online]} ⛔ {self.statuses[Status.dnd]} 🌙 {self.statuses[Status.idle]}"
+
+
+counters = MemberCounters()
+
 
-member_count = 0
 
 class MemberCount(Cog):
     """Compte des membres sur le serveur"""
 
     def __init__(self, bot):
         self.bot: Bot = bot
+        router.subscribe(Transition.ENTERED_INFOCHANNEL, self.on_voice_update)
+
+
+    def cog_unload(self):
+        router.unsubscribe(self)
 
 
     @Cog.listener()
     async def on_member_join(self, member: Member):
         """Increase the count"""
 
-        if not member.bot:
+        if not member.bot and member.guild.id == TAVERN_ID:
             log(member, "just joined")
-            await self.update()
+            counters.add(member)
+            self.update()
 
 
     @Cog.listener()
     async def on_member_remove(self, member: Member):
         """Decrease the count"""
 
-        if not member.bot:
+        if not member.bot and member.guild.id == TAVERN_ID:
             log(member, "has left")
-            await self.update()
+            counters.remove(member)
+            self.update()
 
 
-    @Cog.listener()
-    async def on_voice_state_update(self, member: Member, before: VoiceState, after: VoiceState):
+    async def on_voice_update(self, event: VoiceEvent):
         """Kick members entering the channel"""
 
-        if after.channel:
-            if after.channel.id == MEMBERS_INFOCHANNEL:
-                await member.move_to(before.channel)
+        if event.after.channel.id == MEMBERS_INFOCHANNEL:
+            await event.member.move_to(event.before.channel)
 
 
-    async def update(self):
-        guild: Guild = self.bot.get_guild(TAVERN_ID)
-        infochannel: VoiceChannel = self.bot.get_channel(MEMBERS_INFOCHANNEL)
-        count = len([x for x in guild.members if not x.bot])
+    def update(self):
+        if not counters.counted:
+            return
 
-        await infochannel.edit(name=f"Membres : {count}")
+        infochannel: VoiceChannel = self.bot.get_channel(MEMBERS_INFOCHANNEL)
+        renamer.rename(infochannel, counters.members_name())
 
 
 
@@ -53,30 +112,53 @@ class OnlineCount(Cog):
 
     def __init__(self, bot):
         self.bot = bot
+        router.subscribe(Transition.ENTERED_INFOCHANNEL, self.on_voice_update)
+
+        if self.bot.is_ready():
+            # Reloaded cog, the counters are new and need a full count before the events can update them
+            self.online_count_loop.start()
+
+
+    def cog_unload(self):
+        router.unsubscribe(self)
+        # The loop is bound to this instance, cancelling it from the class would not stop it
+        self.online_count_loop.cancel()
 
 
     global count_loop
 
-    @tasks.loop(minutes=2)
+    @tasks.loop(seconds=INFOCHANNELS_RECOUNT_TIMER.total_seconds())
     async def online_count_loop(self):
         guild: Guild = self.bot.get_guild(TAVERN_ID)
-        channel: VoiceChannel = guild.get_channel(ONLINES_INFOCHANNEL)
 
-        not_offlines = [member for member in guild.members if not member.bot and member.status != Status.offline]
-        onlines = [member for member in not_offlines if member.status == Status.online]
-        dnds = [member for member in not_offlines if member.status == Status.dnd]
-        idles = [member for member in not_offlines if member.status == Status.idle]
+        # The counters are kept up to date by the events, this is only to correct a possible drift
+        counters.recount(guild)
+        self.update()
+        renamer.rename(guild.get_channel(MEMBERS_INFOCHANNEL), counters.members_name())
+
 
-        await channel.edit(name=f"🟢 {len(onlines)} ⛔ {len(dnds)} 🌙 {len(idles)}")
+    def update(self):
+        if not counters.counted:
+            return
+
+        channel: VoiceChannel = self.bot.get_channel(ONLINES_INFOCHANNEL)
+        renamer.rename(channel, counters.onlines_name())
 
 
     @Cog.listener()
-    async def on_voice_state_update(self, member: Member, before: VoiceState, after: VoiceState):
+    async def on_presence_update(self, before: Member, after: Member):
+        if after.bot or after.guild.id != TAVERN_ID or before.status == after.status:
+            return
+
+        counters.change_status(before.status, after.status)
+        self.update()
+
+
+    async def on_voice_update(self, event: VoiceEvent):
         """Kick members entering the channel"""
 
-        if after.channel:
-            if after.channel.id == ONLINES_INFOCHANNEL:
-                await member.move_to(before.channel)
+        if event.after.channel.id == ONLINES_INFOCHANNEL:
+            await event.member.move_to(event.before.channel)
 
 
     @Cog.listener()
@@ -92,6 +174,3 @@ def setup(bot):
     print("    + MemberCount")
     bot.add_cog(OnlineCount(bot))
     print("    + OnlineCount")
-
-def on_teardown(bot):
-    OnlineCount.online_count_loop.cancel()
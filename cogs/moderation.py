@@ -1,12 +1,145 @@
-from discord import Cog, ApplicationContext, Bot, Member, default_permissions, slash_command, option
+from discord import Cog, ApplicationContext, AutocompleteContext, Bot, Guild, Member, OptionChoice, User, default_permissions, slash_command, option
 from discord.utils import get
 from resources.utils import log
+from typing import Optional
+import asyncio
+import bisect
+
+
+def normalize(name: str) -> str:
+    return name.strip().lower()
+
+
+
+class BanIndex:
+    """Banned users of a guild, by ID and by normalized username, kept up to date with the ban events"""
+
+    def __init__(self):
+        self.users: dict[int, User] = {}
+        self.names: dict[str, int] = {}
+        """User ID of each normalized `str(user)`, the username or the legacy `name#1234` tag"""
+        self.sorted_names: list[str] = []
+        """The keys of `names` in order, to find the names starting with a prefix"""
+
+
+    def __len__(self) -> int:
+        return len(self.users)
+
+
+    def add(self, user: User):
+        self.remove(user.id)
+        name = normalize(str(user))
+        self.users[user.id] = user
+        if name not in self.names:
+            bisect.insort(self.sorted_names, name)
+        self.names[name] = user.id
+
+
+    def remove(self, user_id: int) -> Optional[User]:
+        user = self.users.pop(user_id, None)
+        if user:
+            name = normalize(str(user))
+            if self.names.get(name) == user_id:
+                del self.names[name]
+                del self.sorted_names[bisect.bisect_left(self.sorted_names, name)]
+        return user
+
+
+    def get(self, text: str) -> Optional[User]:
+        """The banned user with this ID or username"""
+
+        text = normalize(text)
+        if text.isdigit() and int(text) in self.users:
+            return self.users[int(text)]
+        if text in self.names:
+            return self.users[self.names[text]]
+
+
+    def starting_with(self, prefix: str, limit: int) -> list[User]:
+        """The first banned users in alphabetical order whose username starts with a prefix"""
+
+        prefix = normalize(prefix)
+        start = bisect.bisect_left(self.sorted_names, prefix)
+        found = []
+
+        for name in self.sorted_names[start:start + limit]:
+            if not name.startswith(prefix):
+                break
+            found.append(self.users[self.names[name]])
+
+        return found
+
+
+
+ban_indexes: dict[int, BanIndex] = {}
+"""Ban index of each guild, loaded in the background once the bot is ready"""
+ban_locks: dict[int, asyncio.Lock] = {}
+
+
+async def get_bans(guild: Guild) -> BanIndex:
+    """The ban index of a guild, fetching the ban list the first time"""
+
+    async with ban_locks.setdefault(guild.id, asyncio.Lock()):
+        if guild.id not in ban_indexes:
+            index = BanIndex()
+            async for entry in guild.bans(limit=None):
+                index.add(entry.user)
+            ban_indexes[guild.id] = index
+            log(f"{len(index)} bans loaded for {guild.name}")
+
+    return ban_indexes[guild.id]
+
+
+async def load_bans(guild: Guild):
+    """Fill the ban index of a guild ahead of the commands needing it"""
+
+    try:
+        await get_bans(guild)
+    except Exception as e:
+        log(f"Could not load the bans of {guild.name}:", repr(e))
+
+
+async def banned_autocomplete(ctx: AutocompleteContext) -> list[OptionChoice]:
+    # Paging through a large ban list would exceed the autocomplete deadline, nothing is suggested until it is loaded
+    index = ban_indexes.get(ctx.interaction.guild.id)
+    if index is None:
+        return []
+    return [OptionChoice(str(user), str(user.id)) for user in index.starting_with(ctx.value or "", 25)]
+
+
 
 class Moderation(Cog):
     """Commandes de modération"""
 
     def __init__(self, bot):
         self.bot: Bot = bot
+        if self.bot.is_ready():
+            # Reloaded cog, on_ready won't be called again
+            self.load_all_bans()
+
+
+    def load_all_bans(self):
+        for guild in self.bot.guilds:
+            self.bot.loop.create_task(load_bans(guild))
+
+
+    @Cog.listener()
+    async def on_ready(self):
+        # Already loaded indexes are kept, on_ready is also called when a new gateway session starts
+        self.load_all_bans()
+
+
+    @Cog.listener()
+    async def on_member_ban(self, guild: Guild, user: User):
+        # Not loaded yet, the ban will be in the list when it is fetched
+        if guild.id in ban_indexes:
+            ban_indexes[guild.id].add(user)
+
+
+    @Cog.listener()
+    async def on_member_unban(self, guild: Guild, user: User):
+        if guild.id in ban_indexes:
+            ban_indexes[guild.id].remove(user.id)
 
 
     @slash_command(name='kick')
@@ -47,27 +180,25 @@ class Moderation(Cog):
 
     @slash_command(name='unban')
     @default_permissions(ban_members=True)
-    @option("member", description="Le pseudo et le tag du membre que vous voulez dé-bannir. Ex: Michel#3516")
+    @option("member", description="Le pseudo ou l'ID du membre que vous voulez dé-bannir", autocomplete=banned_autocomplete)
     async def unban(self, ctx: ApplicationContext, member: str):
         """Révoquer le bannissement d'un membre"""
 
-        try:
-            member_name, member_discriminator = member.split('#')
-        except ValueError:
-            await ctx.respond("Merci d'entrer un tag d'utilisateur valide (ex: Michel#3516)", ephemeral=True)
-            return
+        if ctx.guild.id not in ban_indexes:
+            # The ban list is still being fetched
+            await ctx.defer()
+        index = await get_bans(ctx.guild)
+        user = index.get(member)
 
-        banned_users = await ctx.guild.bans()
-        for ban_entry in banned_users:
-            user = ban_entry.user
-
-            if (user.name, user.discriminator) == (member_name, member_discriminator):
-                await ctx.guild.unban(user)
-                log(member, "has been unbanned by", ctx.author)
-                await ctx.respond(f"{member} a été dé-banni par {ctx.author.mention}")
-                return
+        if not user:
+            await ctx.respond(f"{member} n'est pas banni du serveur ou n'existe pas...", ephemeral=True)
+            return
 
-        await ctx.respond(f"{member} n'est pas banni du serveur ou n'existe pas...", ephemeral=True)
+        await ctx.guild.unban(user)
+        # Removed now rather than by the event, in case the command is used again before it arrives
+        index.remove(user.id)
+        log(user, "has been unbanned by", ctx.author)
+        await ctx.respond(f"{user} a été dé-banni par {ctx.author.mention}")
 
 
     @slash_command(name='mute-text')
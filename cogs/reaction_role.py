@@ -1,9 +1,13 @@
 from discord import ApplicationContext, AutocompleteContext, Bot, Cog, Emoji, Guild, Embed, Message, Permissions, RawReactionActionEvent, Role, SlashCommandGroup, TextChannel, option
 from discord.ext.commands import is_owner
-from data.config import REACTION_ROLES_PATH
+from data.config import REACTION_ROLES_PATH, REACTION_ROLES_FETCHES, REACTION_ROLES_WORKERS, REACTION_ROLES_INTERVAL
 from typing import Union, Optional
+from functools import partial
+from resources.queue import WorkQueue
 from resources.utils import log
+import asyncio
 import json
+import os
 
 
 
@@ -80,6 +84,7 @@ class ReactionRole:
             self.guild = channel.guild
         else:
             self.message = await self.channel.send(embed=self.embed())
+        build_index()
         
         await self.update_reactions()
     
@@ -108,6 +113,7 @@ class ReactionRole:
         """Add a choice with an associated role, emoji and label"""
         
         self.choices.append(ReactionChoice(role.name, role, emoji, label))
+        build_index()
     
     
     def remove_choice(self, name: str):
@@ -116,19 +122,124 @@ class ReactionRole:
         for i, choice in enumerate(self.choices):
             if choice.name == name:
                 del self.choices[i]
+                build_index()
                 return
+    
+    
+    async def fetch_reactors(self) -> "dict[Role, set[int]]":
+        """Return the IDs of the users reacting to the message, by role of their choice"""
+        
+        # Fetched again for the current reactions
+        self.message = await self.channel.fetch_message(self.message.id)
+        reactions = {emoji_id(reaction.emoji) or reaction.emoji.id: reaction for reaction in self.message.reactions}
+        
+        # Several choices may share a role, the role is kept if any of their reactions is there
+        reacted: dict[Role, set[int]] = {}
+        for choice in self.choices:
+            users = reacted.setdefault(choice.role, set())
+            if reaction := reactions.get(emoji_id(choice.emoji)):
+                # Fetched 100 users at a time
+                async for user in reaction.users():
+                    users.add(user.id)
+        
+        return reacted
 
 
 reaction_roles: list[ReactionRole] = []
+role_queue = WorkQueue("Reaction-roles", REACTION_ROLES_WORKERS, REACTION_ROLES_INTERVAL)
+"""Role changes made when the reactions are reconciled"""
+saved_data: Optional[str] = None
+"""Content of the data file as it was last read or written"""
+save_lock = asyncio.Lock()
+index: dict[int, dict[Union[int, str], tuple[ReactionRole, ReactionChoice]]] = {}
+"""Reaction-role and choice of each message ID and emoji key, to handle a reaction with dict lookups"""
+
+
+async def reconcile_roles(bot: Bot, reacted: dict[Role, set[int]], kept: set[Role]) -> dict[str, int]:
+    """Give the roles to the users reacting for them and remove them from the others, the `kept` roles are only given.
+    Return the number of roles `granted` and `revoked`, and the changes that `failed`"""
+    
+    report = {"granted": 0, "revoked": 0, "failed": 0}
+    reason = "Réactions manquées pendant que le bot était hors ligne"
+    # Results of this reconciliation's own changes, the queue may be running those of another one
+    changes = []
+    
+    for role, users in reacted.items():
+        guild = role.guild
+        holders = {member.id for member in role.members}
+        
+        for user_id in users - holders:
+            if user_id != bot.user.id and guild.get_member(user_id):
+                changes.append(role_queue.submit((user_id, role.id), partial(bot.http.add_role, guild.id, user_id, role.id, reason=reason)))
+                report["granted"] += 1
+        
+        if role in kept:
+            continue
+        
+        for user_id in holders - users:
+            changes.append(role_queue.submit((user_id, role.id), partial(bot.http.remove_role, guild.id, user_id, role.id, reason=reason)))
+            report["revoked"] += 1
+    
+    errors = await asyncio.gather(*changes)
+    report["failed"] = sum(error is not None for error in errors)
+    return report
 
 
-def save_data(rr_list: list[ReactionRole]):
-    with open(REACTION_ROLES_PATH, 'w') as file:
-        json.dump(
-            {rr.name: rr.dict() for rr in rr_list},
-            file,
-            indent=4
-        )
+def build_index():
+    """Index the choices of every reaction-role by message and emoji, after they changed"""
+    
+    global index
+    new_index = {}
+    
+    for reac_role in reaction_roles:
+        choices = new_index.setdefault(reac_role.message.id, {})
+        for choice in reac_role.choices:
+            key = emoji_id(choice.emoji)
+            if key is not None:
+                choices.setdefault(key, (reac_role, choice))
+    
+    index = new_index
+
+
+def lookup(payload: RawReactionActionEvent) -> Optional[tuple[ReactionRole, ReactionChoice]]:
+    """The reaction-role and choice matching a reaction, if any"""
+    
+    choices = index.get(payload.message_id)
+    if choices is None:
+        return None
+    
+    # Custom emojis are indexed by ID, standard ones by their character
+    return choices.get(payload.emoji.id or payload.emoji.name)
+
+
+def read_data() -> str:
+    with open(REACTION_ROLES_PATH, encoding="utf-8") as file:
+        return file.read()
+
+
+def write_data(content: str):
+    """Write to a temporary file then replace the data file with it, so a crash never leaves a half-written file"""
+    
+    temp_path = REACTION_ROLES_PATH + ".tmp"
+    with open(temp_path, 'w', encoding="utf-8") as file:
+        file.write(content)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, REACTION_ROLES_PATH)
+
+
+async def save_data(rr_list: list[ReactionRole]):
+    """Write the reaction-roles in a thread, unless the file already has the same content"""
+    
+    global saved_data
+    # Serialized right away, the reaction-roles may change while the file is written
+    content = json.dumps({rr.name: rr.dict() for rr in rr_list}, indent=4)
+    
+    async with save_lock:
+        if content == saved_data:
+            return
+        await asyncio.to_thread(write_data, content)
+        saved_data = content
 
 
 def get_by_name(rr_list: list[ReactionRole], name: str) -> ReactionRole:
@@ -157,23 +268,59 @@ class ReactionRoleCog(Cog):
 
     def __init__(self, bot):
         self.bot: Bot = bot
-        self.bot.loop.create_task(self.load_reaction_roles())
+        self.bot.loop.create_task(self.startup())
+    
+    
+    def cog_unload(self):
+        role_queue.close()
+    
+    
+    async def startup(self):
+        await self.load_reaction_roles()
+        await self.reconcile_all(reaction_roles)
+    
+    
+    async def reconcile_all(self, rr_list: list[ReactionRole]) -> dict[str, int]:
+        """Give and remove the roles of the reactions added or removed while the bot wasn't listening.
+        A role given by several reaction-roles is compared to the reactions of all of them"""
+        
+        reacted: dict[Role, set[int]] = {}
+        fetched = []
+        
+        for reac_role in rr_list:
+            try:
+                reactors = await reac_role.fetch_reactors()
+            except Exception as e:
+                log(f'Reconciliation of the reaction-role "{reac_role}" failed:', repr(e))
+                continue
+            
+            fetched.append(reac_role)
+            for role, users in reactors.items():
+                reacted.setdefault(role, set()).update(users)
+        
+        # A role also given by a reaction-role whose reactions were not read may be held through it, it is not removed
+        kept = {choice.role for reac_role in reaction_roles if reac_role not in fetched for choice in reac_role.choices}
+        total = await reconcile_roles(self.bot, reacted, kept)
+        
+        log(f"Reaction-roles reconciled: {total['granted']} roles given, {total['revoked']} removed, {total['failed']} failed")
+        return total
     
     
     async def load_reaction_roles(self):
         """Read the data file and initialize the main ReactionRole list"""
         
         await self.bot.wait_until_ready()
-        global reaction_roles
-        reaction_roles = []
+        global reaction_roles, saved_data
         
-        with open(REACTION_ROLES_PATH, encoding="utf-8") as file:
-            data: dict = json.load(file)
-            
-        for rr_name, rr_data in data.items():
+        content = await asyncio.to_thread(read_data)
+        data: dict = json.loads(content)
+        fetches = asyncio.Semaphore(REACTION_ROLES_FETCHES)
+        
+        async def load(rr_name: str, rr_data: dict) -> ReactionRole:
             guild = self.bot.get_guild(rr_data["guild"])
             channel = guild.get_channel(rr_data["channel"])
-            message = await channel.fetch_message(rr_data["message"])
+            async with fetches:
+                message = await channel.fetch_message(rr_data["message"])
             
             title = rr_data["title"]
             color = rr_data["color"]
@@ -188,7 +335,12 @@ class ReactionRoleCog(Cog):
                     choice_data.get("label")
                 ))
             
-            reaction_roles.append(ReactionRole(rr_name, guild, channel, message, title, color, choices))
+            return ReactionRole(rr_name, guild, channel, message, title, color, choices)
+        
+        # The messages are fetched concurrently, the list keeps the order of the file
+        reaction_roles = list(await asyncio.gather(*(load(rr_name, rr_data) for rr_name, rr_data in data.items())))
+        saved_data = content
+        build_index()
 
 
     def get_emoji(self, id: Union[int, str]) -> Union[int, str]:
@@ -202,47 +354,24 @@ class ReactionRoleCog(Cog):
 
     @Cog.listener()
     async def on_raw_reaction_add(self, payload: RawReactionActionEvent):
-        # Check if the member is the bot
-        if payload.user_id == self.bot.user.id:
+        # Reactions on other messages are rejected with one dict miss
+        if not (match := lookup(payload)) or payload.user_id == self.bot.user.id:
             return
         
-        global reaction_roles
-
-        for reac_role in reaction_roles:
-            # Check if the message id matches with the one in the json data
-            if payload.message_id != reac_role.message.id:
-                continue
-
-            # Loop in the emojis of the rr in the json data
-            for choice in reac_role.choices:
-                # Give the role associated to the emoji
-                if emoji_id(choice.emoji) in (payload.emoji.id, payload.emoji.name):
-                    await payload.member.add_roles(choice.role)
-                    log(f'"{choice.role.name}" given to {payload.member} by the reaction-role "{reac_role.name}"')
-                    break
+        reac_role, choice = match
+        await payload.member.add_roles(choice.role)
+        log(f'"{choice.role.name}" given to {payload.member} by the reaction-role "{reac_role.name}"')
 
 
     @Cog.listener()
     async def on_raw_reaction_remove(self, payload: RawReactionActionEvent):
-        # Check if the member is the bot
-        if payload.user_id == self.bot.user.id:
+        if not (match := lookup(payload)) or payload.user_id == self.bot.user.id:
             return
         
-        global reaction_roles
-
-        for reac_role in reaction_roles:
-            # Check if the message id matches with the one in the json data
-            if payload.message_id != reac_role.message.id:
-                continue
-
-            for choice in reac_role.choices:
-                # Remove the role associated to the emoji (longer code because on_raw_reaction_remove() only provides the member id in the payload)
-                if emoji_id(choice.emoji) in (payload.emoji.id, payload.emoji.name):
-                    guild = self.bot.get_guild(payload.guild_id)
-                    member = guild.get_member(payload.user_id)
-                    await member.remove_roles(choice.role)
-                    log(f'"{choice.role.name}" removed from {member} by the reaction-role "{reac_role.name}"')
-                    break
+        # The payload only has the member ID, which is all the route needs
+        reac_role, choice = match
+        await self.bot.http.remove_role(payload.guild_id, payload.user_id, choice.role.id)
+        log(f'"{choice.role.name}" removed from {payload.user_id} by the reaction-role "{reac_role.name}"')
 
     
     async def name_autocomplete(ctx: AutocompleteContext) -> list[str]:
@@ -282,6 +411,30 @@ class ReactionRoleCog(Cog):
         await ctx.respond(f"Le réaction-rôle **{reac_role}** a bien été actualisé.")
 
 
+    @rr_commands.command(name='reconcile')
+    @option("name", description="Le réaction-rôle à vérifier, tous par défaut", autocomplete=name_autocomplete, required=False)
+    async def reconcile_rr(self, ctx: ApplicationContext, name: Optional[str]):
+        """Donne et retire les rôles des réactions manquées pendant que le bot était hors ligne."""
+
+        await ctx.defer()
+        
+        if name:
+            reac_role = get_by_name(reaction_roles, name)
+            if not reac_role:
+                return await ctx.respond("Nom du réaction-rôle invalide...")
+            rr_list = [reac_role]
+        else:
+            rr_list = reaction_roles
+        
+        report = await self.reconcile_all(rr_list)
+        log("The reaction-roles have been reconciled by", ctx.author)
+        
+        message = f"**{report['granted']}** rôle(s) donné(s) et **{report['revoked']}** retiré(s)."
+        if report["failed"]:
+            message += f" {report['failed']} changement(s) ont échoué."
+        await ctx.respond(message)
+
+
     @rr_commands.command(name='send')
     @is_owner()
     @option("name", description="Le réaction-rôle à envoyer", autocomplete=name_autocomplete)
@@ -302,7 +455,7 @@ class ReactionRoleCog(Cog):
             return await ctx.respond("Nom du réaction-rôle invalide...")
         
         await reac_role.send(channel)
-        save_data(reaction_roles)
+        await save_data(reaction_roles)
         log(f'The reaction-role "{reac_role}" has been sent in #{channel.name} by', ctx.author)
         await ctx.respond(f"Le reaction-role **{reac_role}** a bien été envoyé.")
     
@@ -330,7 +483,7 @@ class ReactionRoleCog(Cog):
         
         reac_role.add_choice(role, emoji, description)
         await reac_role.update_message()
-        save_data(reaction_roles)
+        await save_data(reaction_roles)
         log(f'The role "{role.name}" has been added to the reaction-role "{reac_role}" by', ctx.author)
         await ctx.respond(f"Le choix {role.mention} a bien été ajouté au réaction-rôle **{reac_role}**")
     
@@ -350,7 +503,7 @@ class ReactionRoleCog(Cog):
         
         reac_role.remove_choice(choice)
         await reac_role.update_message()
-        save_data(reaction_roles)
+        await save_data(reaction_roles)
         log(f'The role "{name}" has been removed from the reaction-role "{reac_role}" by', ctx.author)
         await ctx.respond(f"Le choix **{choice}** a bien été supprimé du réaction-rôle **{reac_role}**")
         
@@ -1,7 +1,7 @@
-from discord import Bot, Cog, Guild, Activity
+from discord import Bot, Cog, Guild, Member, Activity
 from data.config import TAVERN_ID, STATUS_TIMER, ANIMES_PATH, MUSIC_GENRES_PATH, VIDEO_GAMES_PATH, MOVIES_PATH
-from typing import List
-from random import choice
+from typing import Callable, Optional
+from resources.status_catalog import rotation
 from discord.ext import tasks
 import asyncio
 
@@ -12,32 +12,26 @@ listening = 2
 watching = 3
 competing = 5
 
-def get_lines(path: str) -> List[str]:
-    return open(path, encoding="utf-8").read().splitlines()
-
-all_status = []
-animes = get_lines(ANIMES_PATH)
-music_genres = get_lines(MUSIC_GENRES_PATH)
-video_games = get_lines(VIDEO_GAMES_PATH)
-movies = get_lines(MOVIES_PATH)
-
 
 class BotStatus(Cog):
     """Changement automatique du status"""
 
     def __init__(self, bot):
         self.bot: Bot = bot
+        if self.bot.is_ready():
+            # Reloaded cog, on_ready won't be called again
+            status_loop.start(self)
 
 
     global status_loop
 
     @tasks.loop()
     async def status_loop(self):
-        self.status_list()
-        for activity in all_status:
-            newActivity = Activity(type=activity[0], name=activity[1])
-            await self.bot.change_presence(activity=newActivity)
-            await asyncio.sleep(STATUS_TIMER.total_seconds())
+        kinds = self.status_kinds()
+        await rotation.refresh()
+        activity_type, name = rotation.next(kinds)
+        await self.bot.change_presence(activity=Activity(type=activity_type, name=name))
+        await asyncio.sleep(STATUS_TIMER.total_seconds())
 
 
     @Cog.listener()
@@ -46,20 +40,32 @@ class BotStatus(Cog):
             status_loop.start(self)
 
 
-    def status_list(self):
-        global all_status
+    @Cog.listener()
+    async def on_member_join(self, member: Member):
+        if not member.bot and member.guild.id == TAVERN_ID:
+            rotation.members.add(member.id)
+
+
+    @Cog.listener()
+    async def on_member_remove(self, member: Member):
+        if member.guild.id == TAVERN_ID:
+            rotation.members.remove(member.id)
+
+
+    def status_kinds(self) -> list[tuple[int, Callable[[], Optional[str]]]]:
+        """The looping status, each with the function giving its next text"""
 
         guild: Guild = self.bot.get_guild(TAVERN_ID)
-        members = [member for member in guild.members if not member.bot]
-
-        # list of all looping status
-        all_status = [
-            [watching, f"{len(members)} membres"],
-            [playing, choice(video_games)],
-            [watching, choice(members).display_name],
-            [watching, choice(animes)],
-            [listening, choice(music_genres)],
-            [watching, choice(movies)]
+        if not rotation.members.filled:
+            rotation.members.fill(guild)
+
+        return [
+            (watching, lambda: f"{len(rotation.members)} membres"),
+            (playing, rotation.file(VIDEO_GAMES_PATH).next),
+            (watching, lambda: getattr(rotation.members.choice(guild), "display_name", None)),
+            (watching, rotation.file(ANIMES_PATH).next),
+            (listening, rotation.file(MUSIC_GENRES_PATH).next),
+            (watching, rotation.file(MOVIES_PATH).next)
         ]
 
 
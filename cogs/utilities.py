@@ -1,4 +1,5 @@
-from discord import Bot, Cog, Member, ApplicationContext, VoiceState, option, slash_command
+from discord import Bot, Cog, Member, ApplicationContext, option, slash_command
+from resources.voice_router import Transition, VoiceEvent, router
 
 
 afk_list = {}
@@ -9,6 +10,11 @@ class Utilities(Cog):
     
     def __init__(self, bot):
         self.bot: Bot = bot
+        router.subscribe(Transition.LEAVE | Transition.MUTE_TOGGLE, self.on_voice_update)
+
+
+    def cog_unload(self):
+        router.unsubscribe(self)
     
     
     async def rename(self, member: Member, new_nick: str, reason: str = None) -> None:
@@ -59,20 +65,20 @@ class Utilities(Cog):
                 afk_list.pop(before.id)
 
 
-    @Cog.listener()
-    async def on_voice_state_update(self, member: Member, before: VoiceState, after: VoiceState):
+    async def on_voice_update(self, event: VoiceEvent):
         global afk_list
+        member, before, after = event.member, event.before, event.after
+
         if member.id in afk_list:
             new_nick = afk_list[member.id]
             
-            if before and not after:
+            if Transition.LEAVE in event.kinds:
                 await self.rename(member, new_nick, "N'est plus AFK")
                 afk_list.pop(member.id)
 
-            elif before and after:
-                if before.self_mute and not after.self_mute:
-                    await self.rename(member, new_nick, "N'est plus AFK")
-                    afk_list.pop(member.id)
+            elif before.self_mute and not after.self_mute:
+                await self.rename(member, new_nick, "N'est plus AFK")
+                afk_list.pop(member.id)
 
 
 def setup(bot):
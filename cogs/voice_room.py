@@ -1,20 +1,26 @@
-from discord import Bot, CategoryChannel, Cog, Member, ActivityType, SlashCommandGroup, VoiceChannel, VoiceState, PermissionOverwrite, ApplicationContext, AllowedMentions, default_permissions, user_command, option
+from discord import Bot, CategoryChannel, Cog, Member, ActivityType, SlashCommandGroup, VoiceChannel, PermissionOverwrite, ApplicationContext, AllowedMentions, default_permissions, user_command, option
 from discord.utils import get
-from data.config import REDIRECT_VOICE_CHANNEL, ROOMS_CATEGORY, ROOMS_DB_COLLECTION, ROOM_LEADER_OVERWRITES, ROOM_ALONE_TIMER, BOT_ROLE, TIMEZONE
-from typing import Optional
+from data.config import ROOMS_CATEGORY, ROOMS_DB_COLLECTION, ROOM_LEADER_OVERWRITES, ROOM_ALONE_TIMER, ROOMS_CLEANUP_WORKERS, ROOMS_POOL_SIZE, ROOMS_POOL_NAME, BOT_ROLE, TIMEZONE
+from typing import Callable, Optional
 from resources.utils import log, time2str
-from resources.database import database
+from resources.database import get_collection
+from resources.queue import WorkQueue
+from resources.scheduler import Scheduler
+from resources.renamer import renamer
+from resources.voice_router import Transition, VoiceEvent, router
 from datetime import datetime, timedelta
+from pymongo import UpdateOne
 from pytz import timezone
 import asyncio
 
 
-col = database.get_collection(ROOMS_DB_COLLECTION)
-tasks = {}
+col = get_collection(ROOMS_DB_COLLECTION)
+cleanup_queue = WorkQueue("Rooms cleanup", ROOMS_CLEANUP_WORKERS)
+scheduler = Scheduler("Rooms countdowns")
 
 
 class Room:
-    def __init__(self, channel: VoiceChannel, leader: Member, locked: bool = False, auto_name: bool = True):
+    def __init__(self, channel: VoiceChannel, leader: Member, locked: bool = False, auto_name: bool = True, alone_deadline: float = None):
         self.channel = channel
         """The discord.VoiceChannel object"""
 
@@ -24,57 +30,77 @@ class Room:
         """Whether or not the room is locked to other members"""
         self.auto_name = auto_name
         """Whether or not the room's name is synchronized with the leader's activity"""
+        self.alone_deadline = alone_deadline
+        """Timestamp when the room will be deleted if its member is still alone, `None` if there is no countdown"""
+        self.lock = asyncio.Lock()
+        """Held while changes are applied to the channel, so that they are applied one after the other"""
 
 
-    def commit(self):
-        """Push room data into the database"""
-
-        data = {
+    def dict(self) -> dict:
+        return {
             "guild": self.channel.guild.id,
             "leader": self.leader.id,
             "locked": self.locked,
-            "auto_name": self.auto_name
+            "auto_name": self.auto_name,
+            "alone_deadline": self.alone_deadline
         }
-        return col.update_one({"_id": self.channel.id}, {"$set": data}, upsert=True)
 
 
-    def unregister(self):
-        """Remove the room from the database"""
-        return col.delete_one({"_id": self.channel.id})
+    async def commit(self):
+        """Push room data into the registry and the database"""
+        return await registry.save(self)
+
+
+    async def unregister(self):
+        """Remove the room from the registry and the database"""
+
+        scheduler.cancel(self.channel.id)
+        return await registry.remove(self.channel.id)
 
 
     async def delete(self, reason: str = None):
         """Delete the room"""
 
-        result = self.unregister()
+        result = await self.unregister()
         await self.channel.delete(reason=reason)
         return result
 
 
-    async def delete_after(self, delay: timedelta, reason: str = None):
-        """Delete the room after the given delay"""
-
-        await asyncio.sleep(delay.total_seconds())
-        try:
-            await self.delete(reason)
-        except:
-            pass
+    def schedule_alone_deletion(self):
+        """Register the countdown deadline in the scheduler"""
+        scheduler.schedule(self.channel.id, self.alone_deadline, lambda: delete_alone_room(self.channel.id))
 
 
     async def begin_alone_countdown(self):
         """Will delete the room in a certain amount of time"""
 
-        tasks[str(self.channel.id)] = asyncio.create_task(self.delete_after(ROOM_ALONE_TIMER, "Membre connecté seul"))
-        timestamp = int((datetime.now(timezone(TIMEZONE)) + ROOM_ALONE_TIMER).timestamp())
-        await self.channel.send(f"Cette room sera supprimée si personne ne rejoint dans **{time2str(ROOM_ALONE_TIMER)}** (<t:{timestamp}:R>)")
+        self.alone_deadline = (datetime.now(timezone(TIMEZONE)) + ROOM_ALONE_TIMER).timestamp()
+        self.schedule_alone_deletion()
+        # Saved with the room, so that the countdown is resumed after a restart
+        await self.commit()
+        await self.channel.send(f"Cette room sera supprimée si personne ne rejoint dans **{time2str(ROOM_ALONE_TIMER)}** (<t:{int(self.alone_deadline)}:R>)")
+
+
+    async def stop_alone_countdown(self):
+        """Stop the countdown started with `begin_alone_countdown()`"""
+
+        scheduler.cancel(self.channel.id)
+        if self.alone_deadline is not None:
+            self.alone_deadline = None
+            await self.commit()
+
 
+    def changes(self) -> "RoomChanges":
+        """Start collecting changes to apply to the room at once"""
+        return RoomChanges(self)
 
-    async def rename_to_game(self, member: Member) -> Optional[str]:
-        """Change the room's name to a member's game name, no changes if the member is not playing"""
+
+    def rename_to_game(self, member: Member) -> Optional[str]:
+        """Request to change the room's name to a member's game name, no changes if the member is not playing"""
 
         game = game_name(member)
-        if game and self.channel.name != game:
-            await self.channel.edit(name=game, reason="Le chef de la room a changé de jeu")
+        if game:
+            renamer.rename(self.channel, game, reason="Le chef de la room a changé de jeu")
         return game
 
 
@@ -83,18 +109,19 @@ class Room:
 
         old_leader = self.leader
         self.leader = new_leader
-        self.commit()
+        changes = self.changes()
 
         if reset_overwrites or not self.locked:
-            await self.channel.set_permissions(old_leader, overwrite=None)
+            changes.set_permissions(old_leader, overwrite=None)
         else:
-            await self.channel.set_permissions(old_leader, connect=True)
+            changes.set_permissions(old_leader, connect=True)
 
-        await self.channel.set_permissions(new_leader, overwrite=ROOM_LEADER_OVERWRITES)
+        changes.set_permissions(new_leader, overwrite=ROOM_LEADER_OVERWRITES)
 
-        if self.auto_name:
-            await self.rename_to_game(new_leader)
+        if self.auto_name and (game := game_name(new_leader)):
+            changes.rename(game)
 
+        await changes.apply(reason="Changement de leader de la room", commit=True)
         log(new_leader, f'is the new leader of the room "{self.channel.name}"')
         return new_leader
 
@@ -123,18 +150,263 @@ class Room:
 
 
 
-def get_room(channel: VoiceChannel) -> Optional[Room]:
-    """Get a room's, `None` if not found"""
+class RoomChanges:
+    """Overwrites and name changes of a room, applied with a single channel edit.
+
+    The edit sends the whole overwrites map. The changes are recorded and made on a copy of the channel's overwrites
+    taken under the room's lock, so two transactions on the same room never undo each other's changes."""
+
+    def __init__(self, room: Room):
+        self.room = room
+        self.operations: list[Callable[[dict], None]] = []
+        """Changes to make on the copy of the overwrites"""
+        self.name: Optional[str] = None
+
+
+    def set_permissions(self, target, overwrite: Optional[PermissionOverwrite] = None, **permissions):
+        """Same as `GuildChannel.set_permissions()`: replace the target's overwrite, or remove it if nothing is given"""
+
+        if overwrite is None and permissions:
+            overwrite = PermissionOverwrite(**permissions)
+
+        def operation(overwrites: dict):
+            if overwrite is None:
+                overwrites.pop(target, None)
+            else:
+                overwrites[target] = overwrite
+
+        self.operations.append(operation)
+
+
+    def update_permissions(self, target, **permissions):
+        """Change some permissions of the target's overwrite, keeping the others"""
+
+        def operation(overwrites: dict):
+            overwrite = overwrites.get(target) or PermissionOverwrite()
+            overwrite.update(**permissions)
+            overwrites[target] = overwrite
+
+        self.operations.append(operation)
+
+
+    def rename(self, name: str):
+        self.name = name
+
+
+    async def apply(self, reason: str = None, commit: bool = False):
+        """Send the changes in one channel edit, along with one database write of the room if `commit` is set"""
+
+        async with self.room.lock:
+            channel = self.room.channel
+            fields = {}
+
+            if self.operations:
+                overwrites = {target: PermissionOverwrite.from_pair(*overwrite.pair()) for target, overwrite in channel.overwrites.items()}
+                for operation in self.operations:
+                    operation(overwrites)
+                fields["overwrites"] = overwrites
+            # When the channel's rename rate limit is reached, the name is applied later by the renamer
+            if self.name and renamer.claim(channel, self.name, reason):
+                fields["name"] = self.name
+
+            requests = []
+            if fields:
+                requests.append(channel.edit(**fields, reason=reason))
+            if commit:
+                requests.append(self.room.commit())
+            results = await asyncio.gather(*requests)
+
+            # The cached channel is only updated when the gateway event comes, the next transaction starts from the edited one
+            if fields and results[0] is not None:
+                self.room.channel = results[0]
+
+
+
+class RoomRegistry:
+    """The live rooms, by channel ID. Changes are written through to the database"""
+
+    def __init__(self):
+        self.rooms: dict[int, Room] = {}
+
+        self.auto_name_leaders: dict[int, int] = {}
+        """Channel ID of the room led by each leader whose room has auto-naming enabled"""
+        self.indexed_leaders: dict[int, int] = {}
+        """Reverse of `auto_name_leaders`, to update it when a room changes"""
+
+
+    def __contains__(self, channel_id: int) -> bool:
+        return channel_id in self.rooms
+
+
+    def get(self, channel_id: int) -> Optional[Room]:
+        return self.rooms.get(channel_id)
+
+
+    def get_auto_named(self, leader_id: int) -> Optional[Room]:
+        """Get the room led by a member if it has auto-naming enabled, `None` otherwise"""
+
+        if leader_id in self.auto_name_leaders:
+            return self.rooms.get(self.auto_name_leaders[leader_id])
+
+
+    def index(self, room: Room):
+        """Update the auto-naming leaders index after a change of the room"""
+
+        self.unindex(room.channel.id)
+
+        if room.auto_name and room.leader:
+            self.auto_name_leaders[room.leader.id] = room.channel.id
+            self.indexed_leaders[room.channel.id] = room.leader.id
+
+
+    def unindex(self, channel_id: int):
+        if (leader_id := self.indexed_leaders.pop(channel_id, None)) is not None:
+            if self.auto_name_leaders.get(leader_id) == channel_id:
+                del self.auto_name_leaders[leader_id]
+
+
+    async def save(self, room: Room):
+        """Register or update a room"""
+
+        self.rooms[room.channel.id] = room
+        self.index(room)
+        # The document may be the one of a pool channel which just became this room
+        return await col.update_one({"_id": room.channel.id}, {"$set": room.dict(), "$unset": {"pool": ""}}, upsert=True)
+
+
+    async def save_many(self, rooms: list[Room]):
+        """Register or update several rooms with a single bulk write"""
+
+        for room in rooms:
+            self.rooms[room.channel.id] = room
+            self.index(room)
+
+        if rooms:
+            return await col.bulk_write([UpdateOne({"_id": room.channel.id}, {"$set": room.dict(), "$unset": {"pool": ""}}, upsert=True) for room in rooms], ordered=False)
+
+
+    def forget(self, channel_id: int):
+        """Unregister a room without touching the database"""
+
+        self.rooms.pop(channel_id, None)
+        self.unindex(channel_id)
+
+
+    async def remove(self, channel_id: int):
+        """Unregister a room"""
+
+        self.forget(channel_id)
+        return await col.delete_one({"_id": channel_id})
+
+
+    def load(self, bot: Bot, documents: list[dict]) -> list[int]:
+        """Rebuild the registry from room documents. Return the IDs of the documents whose channel doesn't exist anymore"""
+
+        self.rooms.clear()
+        self.auto_name_leaders.clear()
+        self.indexed_leaders.clear()
+        orphans = []
+
+        for result in documents:
+            channel_id = result.pop("_id")
+            channel = bot.get_channel(channel_id)
+            if channel:
+                result["leader"] = channel.guild.get_member(result.get("leader"))
+                self.rooms[channel.id] = Room(channel, **result)
+                self.index(self.rooms[channel.id])
+            else:
+                orphans.append(channel_id)
 
-    if not channel:
-        return
+        return orphans
 
-    # Retrieve room from database, without including the id and guild fields
-    result = col.find_one({"_id": channel.id}, {"_id": 0, "guild": 0})
 
-    if result:
-        result["leader"] = channel.guild.get_member(result.get("leader"))
-        return Room(channel, **result)
+registry = RoomRegistry()
+
+
+
+class RoomPool:
+    """Hidden empty channels created in advance, so that a room is ready as soon as a member joins the redirect channel.
+    They are saved in the rooms collection with a `pool` flag."""
+
+    def __init__(self, size: int):
+        self.size = size
+        """Maximum number of channels waiting in the pool"""
+        self.channels: dict[int, VoiceChannel] = {}
+        self.task: Optional[asyncio.Task] = None
+        self.claimed = 0
+        """Number of rooms made from a pool channel"""
+
+
+    def __contains__(self, channel_id: int) -> bool:
+        return channel_id in self.channels
+
+
+    def __len__(self) -> int:
+        return len(self.channels)
+
+
+    def load(self, bot: Bot, documents: list[dict]) -> list[int]:
+        """Rebuild the pool from its documents. Return the IDs of the documents whose channel doesn't exist anymore"""
+
+        self.channels.clear()
+        orphans = []
+
+        for doc in documents:
+            if channel := bot.get_channel(doc["_id"]):
+                self.channels[channel.id] = channel
+            else:
+                orphans.append(doc["_id"])
+
+        return orphans
+
+
+    def claim(self) -> Optional[VoiceChannel]:
+        """Take the oldest channel of the pool, `None` if it is empty"""
+
+        if self.channels:
+            self.claimed += 1
+            return self.channels.pop(next(iter(self.channels)))
+
+
+    def forget(self, channel_id: int) -> bool:
+        return self.channels.pop(channel_id, None) is not None
+
+
+    def refill(self, category: CategoryChannel):
+        """Create the missing channels in the background"""
+
+        if len(self.channels) < self.size and not (self.task and not self.task.done()):
+            self.task = asyncio.create_task(self.fill(category))
+
+
+    async def fill(self, category: CategoryChannel):
+        # One channel at a time, so the pool never exceeds its size
+        while len(self.channels) < self.size:
+            try:
+                channel = await category.create_voice_channel(name=ROOMS_POOL_NAME, overwrites=hidden_overwrites(category.guild), reason="Room en réserve")
+                self.channels[channel.id] = channel
+                await col.update_one({"_id": channel.id}, {"$set": {"guild": category.guild.id, "pool": True}}, upsert=True)
+            except Exception as e:
+                log("Could not fill the rooms pool:", repr(e))
+                return
+
+
+    async def wait(self):
+        """Wait until the refill in progress is done"""
+
+        if self.task and not self.task.done():
+            await asyncio.wait([self.task])
+
+
+
+pool = RoomPool(ROOMS_POOL_SIZE)
+
+
+def get_room(channel: VoiceChannel) -> Optional[Room]:
+    """Get a room's, `None` if not found"""
+
+    if channel:
+        return registry.get(channel.id)
 
 
 def get_member_room(member: Member) -> Optional[Room]:
@@ -160,36 +432,59 @@ def game_name(member: Member) -> Optional[str]:
             return activity.name
 
 
-async def create_room(leader: Member) -> Room:
+def hidden_overwrites(guild) -> dict:
+    """Overwrites of the pool channels, only visible to the bots"""
+
+    return {
+        guild.default_role: PermissionOverwrite(view_channel=False),
+        get(guild.roles, id=BOT_ROLE): PermissionOverwrite(view_channel=True, connect=True)
+    }
+
+
+def room_overwrites(leader: Member) -> dict:
+    """Overwrites of a new room"""
+
     bot_role = get(leader.guild.roles, id=BOT_ROLE)
     muted_role = get(leader.guild.roles, name="Muted")
-    overwrites = {
+    return {
         leader: ROOM_LEADER_OVERWRITES,
         bot_role: PermissionOverwrite(connect=True),
         muted_role: PermissionOverwrite(speak=False)
     }
 
+
+async def open_pool_channel(channel: VoiceChannel, leader: Member, reason: str):
+    """Turn a hidden pool channel into a room with a single edit, its name change counts in the rename rate limit"""
+
+    renamer.record(channel.id)
+    await channel.edit(name=game_name(leader) or leader.display_name, overwrites=room_overwrites(leader), reason=reason)
+
+
+async def create_room(leader: Member) -> Room:
     category = leader.guild.get_channel(ROOMS_CATEGORY)
-    room_name = game_name(leader) or leader.display_name
-    channel = await category.create_voice_channel(name=room_name, overwrites=overwrites, reason=f"A créé une room")
+
+    if channel := pool.claim():
+        await open_pool_channel(channel, leader, "A créé une room")
+    else:
+        channel = await category.create_voice_channel(name=game_name(leader) or leader.display_name, overwrites=room_overwrites(leader), reason=f"A créé une room")
+    pool.refill(category)
 
     await leader.move_to(channel, reason="Téléporté dans une nouvelle room")
     await channel.send(f"Le chef de la room est {leader.mention}", allowed_mentions=AllowedMentions.none())
     log(leader, f'has created the room "{channel.name}"')
 
     room = Room(channel, leader)
-    room.commit()
+    await room.commit()
     return room
 
 
-def stop_alone_countdown(id: int):
-    """Stop the countdown called with `Room.begin_alone_countdown()` for a given room ID"""
+async def delete_alone_room(channel_id: int):
+    """End of an alone countdown: delete the room if nobody joined its last member"""
 
-    try:
-        tasks[str(id)].cancel()
-        del tasks[str(id)]
-    except:
-        pass
+    room = registry.get(channel_id)
+    if room and room.count() <= 1:
+        await room.delete("Membre connecté seul")
+        log(f'The room "{room.channel.name}" has been deleted after its member stayed alone')
 
 
 
@@ -198,24 +493,34 @@ class VoiceRoom(Cog):
 
     def __init__(self, bot):
         self.bot: Bot = bot
+        scheduler.start(self.bot.loop)
         self.bot.loop.create_task(self.handle_rooms())
 
+        self.skipped_presences = 0
+        """Number of presence updates dropped because the member doesn't lead an auto-named room"""
 
-    @Cog.listener()
-    async def on_voice_state_update(self, member: Member, before: VoiceState, after: VoiceState):
-        if member.bot:
-            return
+        router.subscribe(Transition.ENTERED_REDIRECT | Transition.ENTERED_ROOM | Transition.LEFT_ROOM, self.on_voice_update)
 
-        if (channel := after.channel):
-            if channel.id == REDIRECT_VOICE_CHANNEL:
-                room = await create_room(member)
-                await room.begin_alone_countdown()
 
-            elif getattr(channel.category, "id", 0) == ROOMS_CATEGORY:
-                #If the member count in the room went from 1 to higher, cancel the countdown for deleting the room
-                stop_alone_countdown(channel.id)
+    def cog_unload(self):
+        router.unsubscribe(self)
+        # The deadlines are saved with the rooms, the next instance of the cog resumes them
+        scheduler.stop()
+
 
-        if before.channel != after.channel and (room := get_room(before.channel)):
+    async def on_voice_update(self, event: VoiceEvent):
+        member, before, after = event.member, event.before, event.after
+
+        if Transition.ENTERED_REDIRECT in event.kinds:
+            room = await create_room(member)
+            await room.begin_alone_countdown()
+
+        elif Transition.ENTERED_ROOM in event.kinds and (room := get_room(after.channel)):
+            #If the member count in the room went from 1 to higher, cancel the countdown for deleting the room
+            if room.count() > 1:
+                await room.stop_alone_countdown()
+
+        if Transition.LEFT_ROOM in event.kinds and (room := get_room(before.channel)):
             if room.count() == 0:
                 # If the room is now empty
                 try:
@@ -235,14 +540,22 @@ class VoiceRoom(Cog):
 
     @Cog.listener()
     async def on_presence_update(self, before: Member, after: Member):
-        if before.id == self.bot.user.id:
-            return  # If the event was called by the bot itself
+        # Most presence updates come from members who don't lead a room (including the bot itself)
+        if not (room := registry.get_auto_named(after.id)):
+            self.skipped_presences += 1
+            return
 
-        if (room := get_member_room(after)) and room.auto_name and room.leader.id == after.id:
+        if getattr(after.voice, "channel", None) == room.channel:
             # If the member who called this event is a room leader and if its room has auto-naming enabled
-            old = room.channel.name
-            if None != (new := await room.rename_to_game(after)) != old:
-                log(f'The room "{old}" has been auto-renamed to "{new}"')
+            # The renamer logs the new name once it is applied
+            room.rename_to_game(after)
+
+
+    @Cog.listener()
+    async def on_guild_channel_update(self, before: VoiceChannel, after: VoiceChannel):
+        # Back to the cached channel, which now has the changes made by anyone
+        if room := get_room(after):
+            room.channel = after
 
 
     @Cog.listener()
@@ -251,7 +564,9 @@ class VoiceRoom(Cog):
             return
 
         if room := get_room(channel):
-            room.unregister()
+            await room.unregister()
+        elif pool.forget(channel.id):
+            await col.delete_one({"_id": channel.id})
 
 
     room_commands = SlashCommandGroup("room", "Gérez votre room")
@@ -268,13 +583,18 @@ class VoiceRoom(Cog):
             return await ctx.respond("Vous devez être dans une room et en être le leader pour pouvoir en changer les paramètres !", ephemeral=True)
 
         old_name = room.channel.name
-        await room.channel.edit(name=name, reason=f"{ctx.author} a modifié le nom de la room")
+        # Discord only allows 2 renames per channel every 10 minutes, past that the renamer holds the name
+        delay = renamer.delay(room.channel.id)
+        renamer.rename(room.channel, name, reason=f"{ctx.author} a modifié le nom de la room")
 
         room.auto_name = False
-        room.commit()
+        await room.commit()
 
-        log(ctx.author, f'has renamed the room "{old_name}" into "{name}"')
-        await ctx.respond(f'Le nom de la room a été changé en "{name}"')
+        log(ctx.author, f'has requested to rename the room "{old_name}" into "{name}"')
+        if delay:
+            await ctx.respond(f'La room a déjà été renommée récemment, elle sera renommée en "{name}" dans {time2str(timedelta(seconds=delay))}')
+        else:
+            await ctx.respond(f'Le nom de la room a été changé en "{name}"')
 
 
     @room_commands.command(name="auto-name")
@@ -289,13 +609,13 @@ class VoiceRoom(Cog):
 
         if state == "on" and room.auto_name == False:
             room.auto_name = True
-            room.commit()
+            await room.commit()
             log(ctx.author, f'has turned auto-name on in the room "{room.channel.name}"')
             await ctx.respond("Le nom automatique de la room a été activé.")
 
         elif state == "off" and room.auto_name == True:
             room.auto_name = False
-            room.commit()
+            await room.commit()
             log(ctx.author, f'has turned auto-name off in the room "{room.channel.name}"')
             await ctx.respond("Le nom automatique de la room a été désactivé.")
 
@@ -315,19 +635,14 @@ class VoiceRoom(Cog):
         if room.locked == locked:
             return await ctx.respond(f"La room est déjà {state}")
 
-        overwrites = room.channel.overwrites
-        overwrites[ctx.guild.default_role] = PermissionOverwrite(connect=False if locked else None)
+        changes = room.changes()
+        changes.set_permissions(ctx.guild.default_role, connect=False if locked else None)
 
         for member in room.members():
-            if member in overwrites:
-                overwrites[member].connect = locked or None
-            else:
-                overwrites[member] = PermissionOverwrite(connect=locked or None)
-
-        await room.channel.edit(overwrites=overwrites, reason=f"La room a été {state} par {ctx.author}")
+            changes.update_permissions(member, connect=locked or None)
 
         room.locked = locked
-        room.commit()
+        await changes.apply(reason=f"La room a été {state} par {ctx.author}", commit=True)
 
         log(ctx.author, f'has {"locked" if locked else "unlocked"} the room "{room.channel.name}"')
         await ctx.respond("La room a été verrouillée.")
@@ -371,7 +686,9 @@ class VoiceRoom(Cog):
         if member == ctx.author:
             return await ctx.respond("Vous ne pouvez pas vous bannir vous-même !", ephemeral=True)
 
-        await room.channel.set_permissions(member, connect=False, send_messages=False, reason="A été banni d'une room")
+        changes = room.changes()
+        changes.set_permissions(member, connect=False, send_messages=False)
+        await changes.apply(reason="A été banni d'une room")
 
         if getattr(member.voice.channel, "id", 0) == room.channel.id:
             await member.move_to(None)
@@ -390,7 +707,9 @@ class VoiceRoom(Cog):
         if not room or ctx.author != room.leader:
             return await ctx.respond("Vous devez être dans une room et en être le leader pour pouvoir en changer les paramètres !", ephemeral=True)
 
-        await room.channel.set_permissions(member, connect=True, send_messages=True, reason="A été autorisé dans une room")
+        changes = room.changes()
+        changes.set_permissions(member, connect=True, send_messages=True)
+        await changes.apply(reason="A été autorisé dans une room")
 
         log(ctx.author, "has whitelisted", member, f'in the room "{room.channel.name}"')
         await ctx.respond(f"{member.mention} a été autorisé dans la room.")
@@ -425,23 +744,85 @@ class VoiceRoom(Cog):
         await self.set_room_leader(ctx, user)
 
 
-    async def handle_rooms(self):
+    async def handle_rooms(self) -> dict[str, int]:
+        """Reconcile the rooms category with the database, in both directions:
+        documents of deleted channels are removed, empty rooms are deleted and occupied unknown channels become rooms"""
+
         await self.bot.wait_until_ready()
 
         print("Handling deleted rooms...")
         category: CategoryChannel = self.bot.get_channel(ROOMS_CATEGORY)
 
-        room_ids = col.find({}, ["_id"])
-        unknown_rooms = [channel for channel in category.channels if channel.id not in room_ids]
-        to_delete = []
-
-        for channel in unknown_rooms:
-            if len([m for m in channel.members if not m.bot]) == 0:
-                to_delete.append(channel.id)
-                await channel.delete(reason="Room vide")
-
-        if to_delete:
-            col.delete_many({"_id": {"$in": to_delete}})
+        # Don't take the channels being created for the pool for unknown ones
+        await pool.wait()
+
+        documents = await col.find({}, {"guild": 0})
+        orphans = registry.load(self.bot, [doc for doc in documents if not doc.get("pool")])
+        orphans += pool.load(self.bot, [doc for doc in documents if doc.get("pool")])
+
+        # Pool channels which somebody joined anyway become rooms, and the pool may have been made smaller
+        joined_pool = set()
+        for channel in list(pool.channels.values()):
+            if any(not m.bot for m in channel.members):
+                pool.forget(channel.id)
+                joined_pool.add(channel.id)
+        extra = list(pool.channels.values())[pool.size:]
+        for channel in extra:
+            pool.forget(channel.id)
+
+        # Only voice channels, the members of a text channel are everyone who can see it
+        empty = [channel for channel in category.voice_channels if channel.id not in pool and not any(not m.bot for m in channel.members)]
+        unknown = [channel for channel in category.voice_channels if channel.id not in registry and channel.id not in pool and channel not in empty]
+
+        # Unregistered first, so that the deletion events don't write to the database one by one
+        for channel in empty:
+            registry.forget(channel.id)
+
+        if obsolete := orphans + [channel.id for channel in empty]:
+            await col.delete_many({"_id": {"$in": obsolete}})
+
+        # The first member who is not a bot leads the rooms created while the bot was offline
+        adopted = [Room(channel, next(m for m in channel.members if not m.bot)) for channel in unknown]
+        await registry.save_many(adopted)
+
+        # Resume the countdowns, those which expired while the bot was offline run right away
+        rejoined = []
+        for room in registry.rooms.values():
+            if room.alone_deadline is None:
+                continue
+            if room.count() > 1:
+                room.alone_deadline = None
+                rejoined.append(room)
+            else:
+                room.schedule_alone_deletion()
+        await registry.save_many(rejoined)
+
+        failed = cleanup_queue.failed
+        for channel in empty:
+            cleanup_queue.submit(channel.id, lambda channel=channel: channel.delete(reason="Room vide"))
+        await cleanup_queue.join()
+
+        # The leaders of the adopted rooms need their overwrite to manage them, and the pool channels are still hidden
+        results = await asyncio.gather(*(
+            open_pool_channel(room.channel, room.leader, "Room reprise") if room.channel.id in joined_pool
+            else room.channel.set_permissions(room.leader, overwrite=ROOM_LEADER_OVERWRITES, reason="Room reprise")
+            for room in adopted
+        ), return_exceptions=True)
+        for room, result in zip(adopted, results):
+            if isinstance(result, Exception):
+                log(f'Could not give the leader overwrites of the room "{room.channel.name}":', repr(result))
+        pool.refill(category)
+
+        report = {
+            "deleted": len(empty) - (cleanup_queue.failed - failed),
+            "failed": cleanup_queue.failed - failed,
+            "adopted": len(unknown),
+            "orphans": len(orphans),
+            "rooms": len(registry.rooms),
+            "pooled": len(pool)
+        }
+        log("Rooms handled:", ", ".join(f"{count} {name}" for name, count in report.items()))
+        return report
 
 
     @room_commands.command(name="handle")
@@ -449,9 +830,13 @@ class VoiceRoom(Cog):
     async def handle_cmd(self, ctx: ApplicationContext):
         """Handle rooms which were created before the cog was loaded/reloaded"""
 
-        await self.handle_rooms()
-        log("Rooms handling done")
-        await ctx.respond("Rooms handling done")
+        await ctx.defer()
+        report = await self.handle_rooms()
+        await ctx.respond(
+            f"Rooms traitées : **{report['rooms']}** actives, {report['deleted']} vides supprimées, "
+            f"{report['adopted']} non enregistrées reprises, {report['orphans']} entrées orphelines retirées"
+            + (f", {report['failed']} suppressions échouées" if report["failed"] else "")
+        )
 
 
 def setup(bot: Bot):
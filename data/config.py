@@ -27,15 +27,34 @@ BOT_EXTENSIONS = [
     "hyperactive"
 ]
 
+# Database
+DB_POOL_SIZE   = 10                      # Maximum simultaneous connections (and database threads)
+DB_TIMEOUT     = timedelta(seconds=5)    # Maximum time for a single database operation
+DB_BATCH_SIZE  = 5000                    # Documents read per operation when a whole collection is loaded
+DB_RETRY_DELAY = timedelta(seconds=5)    # Delay before loading a collection again after a failure, doubled on each failure
+DB_RETRY_MAX   = timedelta(minutes=5)    # Longest delay between two of these tries
+
+# Channel renames (Discord allows 2 renames of a channel every 10 minutes)
+CHANNEL_RENAME_LIMIT  = 2
+CHANNEL_RENAME_PERIOD = timedelta(minutes=10)
+
+# Performance
+PERF_SLOW_THRESHOLD = timedelta(milliseconds=500)  # Handlers slower than this are logged
+PERF_TOP_LIMIT      = 10                           # Number of handlers shown by /perf
+
 # Error handling
 CONSOLE_CHANNEL = 1046825453006106755
 
 # Infochannels
 MEMBERS_INFOCHANNEL = 1046480685059280896
 ONLINES_INFOCHANNEL = 963536054621716520
+INFOCHANNELS_RECOUNT_TIMER = timedelta(minutes=30)  # Full recount correcting the counters kept from the events
 
 # Reaction-roles
-REACTION_ROLES_PATH = root_path + "/data/reaction_roles.json"
+REACTION_ROLES_PATH     = root_path + "/data/reaction_roles.json"
+REACTION_ROLES_FETCHES  = 4                            # Messages fetched at the same time when the reaction-roles are loaded
+REACTION_ROLES_WORKERS  = 2                            # Role changes sent at the same time when the reactions are reconciled
+REACTION_ROLES_INTERVAL = timedelta(milliseconds=250)  # Minimum delay between two of these role changes
 
 # Status
 STATUS_TIMER      = timedelta(seconds=20)
@@ -50,13 +69,20 @@ ROOMS_CATEGORY         = 996159603324768276
 ROOMS_DB_COLLECTION    = "rooms"
 ROOM_LEADER_OVERWRITES = discord.PermissionOverwrite(manage_channels=True, manage_permissions=True, move_members=True, manage_messages=True)
 ROOM_ALONE_TIMER       = timedelta(minutes=5)
+ROOMS_CLEANUP_WORKERS  = 4  # Number of rooms deleted at the same time when the rooms are handled
+ROOMS_POOL_SIZE        = 2  # Hidden channels created in advance to make rooms faster, 0 disables the pool
+ROOMS_POOL_NAME        = "Nouvelle room"
 
 # Welcome
 WELCOME_CHANNEL = 807900462794932236
 
 # Hyperactive role & leaderboard
 HYPERACTIVE_DB_COLLECTION = "hyperactive"
+HYPERACTIVE_DB_STATE      = "hyperactive_state"    # Last weekly reset made, to make those missed while the bot was offline
 HYPERACTIVE_WEEK_DAY      = 0  # 0 Monday, 1 Tuesday ... 6 Sunday
+HYPERACTIVE_FLUSH_TIMER   = timedelta(seconds=10)  # Maximum delay before member data is written to the database
+HYPERACTIVE_FLUSH_SIZE    = 100                    # Number of pending members that triggers an early write
+HYPERACTIVE_ROLE_WORKERS  = 2                      # Number of member role updates sent at the same time
 HYPERACTIVE_LEVELS = [
     timedelta(0),        # Level 0
     timedelta(hours=1),  # Level 1
@@ -74,4 +100,9 @@ HYPERACTIVE_ROLES = [
     1058360811946516502
 ]
 LEADERBOARD_CHANNEL = 1088766395585675284
-LEADERBOARD_LIMIT = 10
\ No newline at end of file
+LEADERBOARD_LIMIT = 10
+
+# Voice sessions ledger
+SESSIONS_DB_COLLECTION     = "voice_sessions"  # Time series of every voice session
+SESSIONS_ROLLUP_COLLECTION = "voice_daily"     # Hours and sessions per day, member and channel
+SESSIONS_FLUSH_TIMER       = timedelta(seconds=30)
\ No newline at end of file
@@ -1,12 +1,309 @@
-from data.config import DB_NAME
-from pymongo import MongoClient
+from data.config import DB_NAME, DB_POOL_SIZE, DB_TIMEOUT, DB_BATCH_SIZE
+from concurrent.futures import ThreadPoolExecutor
+from resources.utils import log
+from typing import Any, Iterator, Optional
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import OperationFailure
 from dotenv import load_dotenv
+from functools import partial
+from datetime import timedelta
+from time import perf_counter
 from os import getenv
+import threading
+import asyncio
 
 # Private .env file
 load_dotenv()
 db_link = getenv("DATABASE")
 
-# MongoDB Atlas connection
-db_client = MongoClient(db_link)
-database = db_client.get_database(DB_NAME)
\ No newline at end of file
+
+def connect(link: Optional[str]):
+    """Return a pymongo-compatible client. A `mongomock://` link gives an in-memory stand-in to run offline"""
+
+    if link and link.startswith("mongomock://"):
+        import mongomock
+        return mongomock.MongoClient()
+
+    return MongoClient(link, maxPoolSize=DB_POOL_SIZE, timeoutMS=int(DB_TIMEOUT.total_seconds() * 1000))
+
+
+# MongoDB Atlas connection, made on first use (resolving a `mongodb+srv://` link blocks)
+db_client = None
+database = None
+connect_lock = threading.Lock()
+
+# pymongo is blocking, its calls are made in these threads so the event loop never waits on the database
+executor = ThreadPoolExecutor(max_workers=DB_POOL_SIZE, thread_name_prefix="database")
+
+
+def get_database():
+    """Return the bot's database, connecting the client the first time"""
+
+    global db_client, database
+
+    with connect_lock:
+        if database is None:
+            start = perf_counter()
+            db_client = connect(db_link)
+            database = db_client.get_database(DB_NAME)
+            log(f"Database client created in {(perf_counter() - start) * 1000:.0f} ms")
+
+    return database
+
+
+
+class AsyncCollection:
+    """Non-blocking wrapper around a pymongo collection"""
+
+    def __init__(self, name: str, timeout=DB_TIMEOUT):
+        self.name = name
+        self.timeout = timeout.total_seconds()
+        """Maximum time to wait for an operation, in seconds"""
+        self.operations = 0
+        """Number of operations sent to the database"""
+
+
+    @property
+    def collection(self):
+        """The wrapped pymongo (or mongomock) collection"""
+        return get_database().get_collection(self.name)
+
+
+    def call(self, method: str, *args, **kwargs) -> Any:
+        """Call a method of the collection. Cursors are consumed here, so that it all happens in the database threads"""
+
+        result = getattr(self.collection, method)(*args, **kwargs)
+        return list(result) if isinstance(result, Iterator) else result
+
+
+    async def run(self, method: str, *args, **kwargs) -> Any:
+        """Call a method of the collection in the database threads and wait for its result"""
+
+        self.operations += 1
+        future = asyncio.get_running_loop().run_in_executor(executor, partial(self.call, method, *args, **kwargs))
+        return await asyncio.wait_for(future, self.timeout)
+
+
+    async def find_one(self, *args, **kwargs) -> Optional[dict]:
+        return await self.run("find_one", *args, **kwargs)
+
+
+    async def find(self, *args, **kwargs) -> list[dict]:
+        """Unlike pymongo, the cursor is consumed in the database threads and a list is returned"""
+        return await self.run("find", *args, **kwargs)
+
+
+    async def find_all(self, filter: Optional[dict] = None, batch_size: int = DB_BATCH_SIZE) -> list[dict]:
+        """Read every matching document in pages sorted by `_id`.
+        Each page is a separate operation, so the timeout applies to a page and not to the whole collection"""
+
+        documents = []
+
+        while True:
+            page_filter = filter or {}
+            if documents:
+                page_filter = {"$and": [page_filter, {"_id": {"$gt": documents[-1]["_id"]}}]}
+
+            page = await self.find(page_filter, sort=[("_id", 1)], limit=batch_size)
+            documents += page
+            if len(page) < batch_size:
+                return documents
+
+
+    async def insert_one(self, *args, **kwargs):
+        return await self.run("insert_one", *args, **kwargs)
+
+
+    async def insert_many(self, *args, **kwargs):
+        return await self.run("insert_many", *args, **kwargs)
+
+
+    async def update_one(self, *args, **kwargs):
+        return await self.run("update_one", *args, **kwargs)
+
+
+    async def delete_one(self, *args, **kwargs):
+        return await self.run("delete_one", *args, **kwargs)
+
+
+    async def delete_many(self, *args, **kwargs):
+        return await self.run("delete_many", *args, **kwargs)
+
+
+    async def bulk_write(self, *args, **kwargs):
+        return await self.run("bulk_write", *args, **kwargs)
+
+
+    async def aggregate(self, *args, **kwargs) -> list[dict]:
+        return await self.run("aggregate", *args, **kwargs)
+
+
+    async def create_index(self, *args, **kwargs) -> str:
+        return await self.run("create_index", *args, **kwargs)
+
+
+
+def get_collection(name: str) -> AsyncCollection:
+    """Get a non-blocking collection of the bot's database. Nothing is sent until it is used"""
+    return AsyncCollection(name)
+
+
+async def create_time_series(name: str, time_field: str, meta_field: str, granularity: str = "minutes"):
+    """Create a time series collection if it doesn't exist yet.
+    Servers (or stand-ins) without time series support get a regular collection instead"""
+
+    def create():
+        database = get_database()
+        if name in database.list_collection_names():
+            return
+        try:
+            database.create_collection(name, timeseries={"timeField": time_field, "metaField": meta_field, "granularity": granularity})
+        except (OperationFailure, NotImplementedError) as e:
+            log(f"No time series support for {name}, using a regular collection:", repr(e))
+
+    await asyncio.get_running_loop().run_in_executor(executor, create)
+
+
+
+# - - - - - - - - - - - Write-behind - - - - - - - - - - -
+
+
+buffers: list["WriteBuffer"] = []
+"""Running write buffers, flushed when the bot shuts down"""
+
+
+class WriteBuffer:
+    """Merge `$set` updates per document and write them to a collection as a single bulk write"""
+
+    def __init__(self, collection: AsyncCollection, interval: timedelta, max_size: int):
+        self.collection = collection
+        """The collection where the updates are written"""
+        self.interval = interval.total_seconds()
+        """Seconds between two automatic flushes"""
+        self.max_size = max_size
+        """Number of pending documents that triggers a flush without waiting for the interval"""
+
+        self.pending: dict[Any, dict] = {}
+        """Fields waiting to be written, by document id"""
+        self.lock = asyncio.Lock()
+        self.task: Optional[asyncio.Task] = None
+        self.size_task: Optional[asyncio.Task] = None
+        """Flush started because too many documents were pending"""
+
+        self.flush_count = 0
+        """Number of bulk writes sent"""
+        self.last_batch_size = 0
+        """Number of documents in the last bulk write"""
+        self.last_latency = 0.0
+        """Duration of the last bulk write, in seconds"""
+        self.max_latency = 0.0
+        """Longest bulk write, in seconds"""
+        self.written = 0
+        """Total number of documents written"""
+
+
+    def set(self, id: Any, data: dict):
+        """Queue fields to set on a document, overwriting the values still pending for it"""
+
+        self.pending.setdefault(id, {}).update(data)
+
+        if len(self.pending) >= self.max_size and not self.lock.locked() and not (self.size_task and not self.size_task.done()):
+            self.size_task = asyncio.create_task(self.try_flush())
+
+
+    def set_many(self, updates: dict[Any, dict]):
+        """Queue fields for many documents at once, to be written by the next flush"""
+
+        for id, data in updates.items():
+            self.pending.setdefault(id, {}).update(data)
+
+
+    def get(self, id: Any) -> dict:
+        """Return the fields still pending for a document"""
+        return self.pending.get(id, {})
+
+
+    async def flush(self):
+        """Write every pending update in one bulk write"""
+
+        async with self.lock:
+            if not self.pending:
+                return
+
+            batch, self.pending = self.pending, {}
+            start = perf_counter()
+
+            try:
+                await self.collection.bulk_write(
+                    [UpdateOne({"_id": id}, {"$set": data}, upsert=True) for id, data in batch.items()],
+                    ordered = False
+                )
+            except:
+                # Put the batch back without overwriting what was queued in the meantime
+                for id, data in batch.items():
+                    self.pending[id] = data | self.pending.get(id, {})
+                raise
+
+            self.last_latency = perf_counter() - start
+            self.max_latency = max(self.max_latency, self.last_latency)
+            self.last_batch_size = len(batch)
+            self.written += len(batch)
+            self.flush_count += 1
+
+
+    async def try_flush(self) -> bool:
+        """Flush and log the failure if any, the batch stays pending for the next flush. Return whether it succeeded"""
+
+        try:
+            await self.flush()
+            return True
+        except Exception as e:
+            log(f"Write-behind flush on {self.collection.name} failed:", repr(e))
+            return False
+
+
+    async def flush_loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.try_flush()
+
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        """Begin the periodic flushes"""
+
+        buffers.append(self)
+        self.task = loop.create_task(self.flush_loop())
+
+
+    async def close(self):
+        """Stop the periodic flushes and write what is left"""
+
+        if self.task:
+            self.task.cancel()
+        await self.flush()
+
+        if self in buffers:
+            buffers.remove(self)
+
+
+    def stats(self) -> dict:
+        """Values to tune the interval and the size threshold"""
+
+        return {
+            "pending": len(self.pending),
+            "flushes": self.flush_count,
+            "written": self.written,
+            "last_batch": self.last_batch_size,
+            "last_latency": self.last_latency,
+            "max_latency": self.max_latency
+        }
+
+
+
+async def flush_all(collection: Optional[AsyncCollection] = None) -> bool:
+    """Flush every running write buffer, or only those writing to a collection.
+    A failing buffer doesn't keep the others from being written. Return whether they all succeeded"""
+
+    targets = [buffer for buffer in buffers if collection is None or getattr(buffer, "collection", None) and buffer.collection.name == collection.name]
+    results = await asyncio.gather(*(buffer.try_flush() for buffer in targets))
+    return all(results)
@@ -0,0 +1,158 @@
+from typing import Iterable, Optional, Sequence
+from bisect import bisect_left, insort
+from array import array
+import asyncio
+import heapq
+import itertools
+
+
+class MemberCache:
+    """In-memory copy of the hyperactive collection.
+
+    Members are stored as rows of parallel arrays (level, hours, timestamp) instead of one object per member,
+    so a member costs a few bytes in each array plus its entry in the index."""
+
+    def __init__(self):
+        self.index: dict[int, int] = {}
+        """Row of each member ID in the arrays"""
+        self.ids = array("q")
+        self.levels = array("b")
+        self.times = array("d")
+        """Hours spent in a voice channel for the current week"""
+        self.lasts = array("d")
+        """Timestamps of the last time members entered/left a voice channel"""
+
+        self.ranking: list[tuple[float, int]] = []
+        """`(-time, member_id)` of every member with some time this week, sorted from the most active"""
+
+        self.loaded = asyncio.Event()
+        """Set once the cache has been filled from the database"""
+
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+
+    def __contains__(self, member_id: int) -> bool:
+        return member_id in self.index
+
+
+    def load(self, documents: Iterable[dict]):
+        """Fill the cache with documents of the hyperactive collection.
+        Members set while the cache was loading are kept, their values are newer than the documents"""
+
+        newer = {id: self.get(id) for id in self.index}
+        self.index.clear()
+        for array_ in (self.ids, self.levels, self.times, self.lasts):
+            del array_[:]
+
+        rows = ((doc["_id"], doc.get("level", 0), doc.get("time", 0), doc.get("last", 0)) for doc in documents if doc["_id"] not in newer)
+        for id, level, time, last in itertools.chain(rows, ((id, *values) for id, values in newer.items())):
+            self.index[id] = len(self.ids)
+            self.ids.append(id)
+            self.levels.append(level)
+            self.times.append(time)
+            self.lasts.append(last)
+
+        self.rebuild_ranking()
+        self.loaded.set()
+
+
+    def rebuild_ranking(self):
+        # Sorting once is cheaper than inserting every member in the ranking
+        self.ranking = sorted((-time, id) for id, time in zip(self.ids, self.times) if time > 0)
+
+
+    def get(self, member_id: int) -> Optional[tuple[int, float, float]]:
+        """Return the `(level, time, last)` of a member, `None` if not found"""
+
+        row = self.index.get(member_id)
+        if row is None:
+            return None
+        return self.levels[row], self.times[row], self.lasts[row]
+
+
+    def set(self, member_id: int, level: int, time: float, last: float):
+        """Insert or update a member"""
+
+        row = self.index.get(member_id)
+
+        if row is None:
+            old_time = 0
+            self.index[member_id] = len(self.ids)
+            self.ids.append(member_id)
+            self.levels.append(level)
+            self.times.append(time)
+            self.lasts.append(last)
+        else:
+            old_time = self.times[row]
+            self.levels[row] = level
+            self.times[row] = time
+            self.lasts[row] = last
+
+        if time != old_time:
+            self.unrank(member_id, old_time)
+            if time > 0:
+                insort(self.ranking, (-time, member_id))
+
+
+    def reset_rows(self, rows: dict[int, int], last: float):
+        """Start a new week for some rows: set their new level, clear their time and move their last activity"""
+
+        for row, level in rows.items():
+            self.levels[row] = level
+            self.times[row] = 0
+            self.lasts[row] = last
+
+        self.rebuild_ranking()
+
+
+    def unrank(self, member_id: int, time: float):
+        """Remove a member from the ranking"""
+
+        if time > 0:
+            i = bisect_left(self.ranking, (-time, member_id))
+            if i < len(self.ranking) and self.ranking[i][1] == member_id:
+                del self.ranking[i]
+
+
+    def rankings(self, rank_limit: int, since: float) -> list[list[int]]:
+        """Return the IDs of the most active members grouped by rank, ignoring those inactive since the given timestamp.
+        Only reads the top of the ranking."""
+
+        rankings: list[list[int]] = []
+
+        for neg_time, member_id in self.ranking:
+            if self.lasts[self.index[member_id]] < since:
+                continue
+
+            if rankings and -neg_time == self.times[self.index[rankings[-1][0]]]:
+                rankings[-1].append(member_id)
+            elif len(rankings) < rank_limit:
+                rankings.append([member_id])
+            else:
+                break
+
+        return rankings
+
+
+
+def top_rankings(times: Sequence[float], lasts: Sequence[float], rank_limit: int, since: float) -> list[list[int]]:
+    """Return the rows of the most active members grouped by rank, using a bounded heap instead of a full sort"""
+
+    eligible = [i for i, (time, last) in enumerate(zip(times, lasts)) if time > 0 and last >= since]
+    best = heapq.nlargest(rank_limit, {times[i] for i in eligible})
+
+    if not best:
+        return []
+
+    rows = sorted((i for i in eligible if times[i] >= best[-1]), key=times.__getitem__, reverse=True)
+    rankings = [[rows[0]]]
+
+    for i in rows[1:]:
+        if times[i] == times[rankings[-1][0]]:
+            rankings[-1].append(i)
+        else:
+            rankings.append([i])
+
+    return rankings
@@ -0,0 +1,134 @@
+from data.config import PERF_SLOW_THRESHOLD
+from discord import ApplicationContext, Cog
+from typing import Callable, Coroutine
+from resources.utils import log
+from collections import defaultdict
+from time import perf_counter
+from contextlib import contextmanager
+from functools import wraps
+import math
+
+
+class Histogram:
+    """Latency histogram with power-of-two buckets, from about 1µs to 1 minute"""
+
+    OFFSET = 20  # Bucket 0 holds durations up to 2^-20 s
+    SIZE = 27
+
+    def __init__(self):
+        self.buckets = [0] * self.SIZE
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+
+    def add(self, duration: float):
+        exponent = math.frexp(duration)[1]
+        self.buckets[max(0, min(self.SIZE - 1, exponent + self.OFFSET))] += 1
+        self.count += 1
+        self.total += duration
+        self.max = max(self.max, duration)
+
+
+    def percentile(self, p: float) -> float:
+        """Upper bound of the bucket holding the given percentile (between 0 and 1), in seconds"""
+
+        rank = p * self.count
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank:
+                return min(2.0 ** (i - self.OFFSET), self.max)
+        return self.max
+
+
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0
+
+
+
+histograms: defaultdict[str, Histogram] = defaultdict(Histogram)
+"""Latencies by handler name"""
+
+startup: dict[str, float] = {}
+"""Duration of each startup phase in seconds, in the order they ended"""
+
+
+def describe(args: tuple) -> str:
+    """Short description of the arguments of an event"""
+    return ", ".join(repr(arg)[:80] for arg in args)
+
+
+def record(name: str, duration: float, args: tuple = ()):
+    """Add a duration to a handler's histogram, and log it if it was slow"""
+
+    histograms[name].add(duration)
+
+    if duration >= PERF_SLOW_THRESHOLD.total_seconds():
+        log(f"Slow handler {name} ({duration * 1000:.0f} ms):", describe(args))
+
+
+def timed(name: str, func: Callable[..., Coroutine]) -> Callable[..., Coroutine]:
+    """Wrap a coroutine function to record the time of each call"""
+
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        start = perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            record(name, perf_counter() - start, args)
+
+    return wrapper
+
+
+def instrument(cog: Cog):
+    """Time every listener of a cog. Must be called before the cog is added to the bot"""
+
+    for event, method_name in cog.__cog_listeners__:
+        method = getattr(cog, method_name)
+        setattr(cog, method_name, timed(f"{type(cog).__name__}.{method_name}", method))
+
+
+async def timed_command(ctx: ApplicationContext, invoke: Callable[[ApplicationContext], Coroutine]):
+    """Invoke an application command and record its time"""
+
+    start = perf_counter()
+    try:
+        await invoke(ctx)
+    finally:
+        record("/" + ctx.command.qualified_name, perf_counter() - start, (ctx.author, ctx.selected_options))
+
+
+def top(limit: int) -> list[tuple[str, Histogram]]:
+    """The handlers which took the most time overall"""
+    return sorted(histograms.items(), key=lambda item: item[1].total, reverse=True)[:limit]
+
+
+def reset():
+    histograms.clear()
+
+
+@contextmanager
+def phase(name: str):
+    """Record the duration of a startup phase"""
+
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        startup[name] = perf_counter() - start
+
+
+def startup_report(detailed: bool = True) -> str:
+    """Duration of each startup phase. Otherwise the phases of each extension are left out, except the slowest import and load"""
+
+    phases = startup
+    if not detailed:
+        phases = {name: duration for name, duration in startup.items() if not name.startswith(("import ", "load "))}
+        for prefix in ("import ", "load "):
+            if names := [name for name in startup if name.startswith(prefix)]:
+                slowest = max(names, key=startup.__getitem__)
+                phases[f"max: {slowest}"] = startup[slowest]
+
+    return "\n".join(f"{name:<32} {duration * 1000:>8.0f} ms" for name, duration in phases.items())
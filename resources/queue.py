@@ -0,0 +1,114 @@
+from typing import Callable, Coroutine, Hashable, Optional
+from resources.utils import log
+from datetime import timedelta
+import asyncio
+import time
+
+
+class WorkQueue:
+    """Run jobs in the background with a bounded concurrency.
+    A job submitted for a key which already has one waiting replaces it, so only the latest work is done.
+    Jobs of the same key never run at the same time, in the order they were submitted."""
+
+    def __init__(self, name: str, concurrency: int, interval: timedelta = timedelta(0)):
+        self.name = name
+        self.concurrency = concurrency
+        """Maximum number of jobs running at the same time"""
+        self.interval = interval.total_seconds()
+        """Minimum time between the start of two jobs"""
+
+        self.pending: dict[Hashable, Callable[[], Coroutine]] = {}
+        self.running: set[Hashable] = set()
+        """Keys whose job is running, a job submitted for them is queued once it is done"""
+        self.waiters: dict[Hashable, list[asyncio.Future]] = {}
+        """Futures returned by `submit()` for the pending job of each key"""
+        self.queue: asyncio.Queue = None
+        self.workers: list[asyncio.Task] = []
+        self.next_start = 0.0
+
+        self.done = 0
+        """Number of jobs run"""
+        self.replaced = 0
+        """Number of jobs dropped because a newer one was submitted for the same key"""
+        self.failed = 0
+
+
+    def submit(self, key: Hashable, job: Callable[[], Coroutine]) -> asyncio.Future:
+        """Queue a coroutine function to be called, replacing the job waiting for the same key if any.
+        Return a future set when the job, or the one replacing it, is done: to the exception it raised, or `None`"""
+
+        if not self.workers:
+            self.queue = asyncio.Queue()
+            self.workers = [asyncio.create_task(self.work()) for _ in range(self.concurrency)]
+
+        if key in self.pending:
+            self.replaced += 1
+        elif key not in self.running:
+            self.queue.put_nowait(key)
+
+        self.pending[key] = job
+
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.setdefault(key, []).append(future)
+        return future
+
+
+    async def wait_slot(self):
+        """Respect the minimum interval between two jobs"""
+
+        now = time.monotonic()
+        start, self.next_start = max(now, self.next_start), max(now, self.next_start) + self.interval
+        if start > now:
+            await asyncio.sleep(start - now)
+
+
+    async def work(self):
+        while True:
+            key = await self.queue.get()
+            job = self.pending.pop(key)
+            waiters = self.waiters.pop(key, [])
+            self.running.add(key)
+            error: Optional[Exception] = None
+
+            try:
+                await self.wait_slot()
+                await job()
+                self.done += 1
+            except asyncio.CancelledError:
+                for future in waiters:
+                    future.cancel()
+                raise
+            except Exception as e:
+                error = e
+                self.failed += 1
+                log(f"{self.name} job for {key} failed:", repr(e))
+            finally:
+                for future in waiters:
+                    if not future.done():
+                        future.set_result(error)
+                self.running.discard(key)
+                # Submitted while it was running, queued before this job is marked done so that join() waits for it
+                if key in self.pending:
+                    self.queue.put_nowait(key)
+                self.queue.task_done()
+
+
+    async def join(self):
+        """Wait until every submitted job is done"""
+
+        if self.queue:
+            await self.queue.join()
+
+
+    def close(self):
+        """Stop the workers, dropping the jobs still waiting"""
+
+        for worker in self.workers:
+            worker.cancel()
+        self.workers = []
+        self.pending.clear()
+        self.running.clear()
+        for waiters in self.waiters.values():
+            for future in waiters:
+                future.cancel()
+        self.waiters.clear()
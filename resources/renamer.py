@@ -0,0 +1,124 @@
+from data.config import CHANNEL_RENAME_LIMIT, CHANNEL_RENAME_PERIOD
+from discord.abc import GuildChannel
+from typing import Awaitable, Callable, Optional
+from resources.utils import log
+from collections import deque
+from datetime import timedelta
+import asyncio
+import time
+
+
+async def edit_name(channel: GuildChannel, name: str, reason: Optional[str]):
+    await channel.edit(name=name, reason=reason)
+
+
+class ChannelRenamer:
+    """Rename channels without exceeding Discord's rename rate limit and without making the caller wait.
+    Only the latest name requested for a channel is applied."""
+
+    def __init__(
+        self,
+        limit: int,
+        period: timedelta,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], Awaitable] = asyncio.sleep,
+        edit: Callable[[GuildChannel, str, Optional[str]], Awaitable] = edit_name
+    ):
+        self.limit = limit
+        """Number of renames allowed per channel during `period`"""
+        self.period = period.total_seconds()
+        self.clock = clock
+        self.sleep = sleep
+        self.edit = edit
+        """Coroutine function doing the actual REST call"""
+
+        self.history: dict[int, deque[float]] = {}
+        """Times of the last renames of each channel"""
+        self.pending: dict[int, tuple[GuildChannel, str, Optional[str]]] = {}
+        """Latest requested `(channel, name, reason)` of each channel"""
+        self.tasks: dict[int, asyncio.Task] = {}
+
+        self.applied = 0
+        """Number of renames sent to Discord"""
+        self.coalesced = 0
+        """Number of requested names replaced by a newer one before being applied"""
+        self.skipped = 0
+        """Number of requested names which were already the channel's name"""
+
+
+    def rename(self, channel: GuildChannel, name: str, reason: Optional[str] = None):
+        """Request a new name for a channel, applied as soon as the channel's rate limit allows it"""
+
+        if channel.id not in self.pending and channel.name == name:
+            self.skipped += 1
+            return
+
+        if channel.id in self.pending:
+            self.coalesced += 1
+
+        self.pending[channel.id] = (channel, name, reason)
+
+        if channel.id not in self.tasks:
+            self.tasks[channel.id] = asyncio.create_task(self.apply(channel.id))
+
+
+    def claim(self, channel: GuildChannel, name: str, reason: Optional[str] = None) -> bool:
+        """Return True if the caller can rename the channel right now within another edit of its own.
+        Otherwise the name is requested as with `rename()` and False is returned"""
+
+        if channel.id not in self.pending and channel.name == name:
+            self.skipped += 1
+            return False
+
+        if channel.id not in self.pending and not self.delay(channel.id):
+            self.record(channel.id)
+            self.applied += 1
+            return True
+
+        self.rename(channel, name, reason)
+        return False
+
+
+    def delay(self, channel_id: int) -> float:
+        """Seconds to wait before the channel can be renamed again"""
+
+        history = self.history.get(channel_id)
+
+        if not history or len(history) < self.limit:
+            return 0
+        return max(0, history[0] + self.period - self.clock())
+
+
+    def record(self, channel_id: int):
+        """Count a rename in the channel's rate limit, also to be called for renames made outside of the renamer"""
+        self.history.setdefault(channel_id, deque(maxlen=self.limit)).append(self.clock())
+
+
+    async def apply(self, channel_id: int):
+        """Apply the pending names of a channel until there are none left"""
+
+        try:
+            while channel_id in self.pending:
+                if delay := self.delay(channel_id):
+                    await self.sleep(delay)
+
+                channel, name, reason = self.pending.pop(channel_id)
+
+                if channel.name == name:
+                    self.skipped += 1
+                    continue
+
+                old = channel.name
+                self.record(channel_id)
+                try:
+                    await self.edit(channel, name, reason)
+                    self.applied += 1
+                    log(f'Renamed "{old}" into "{name}"' + (f" ({reason})" if reason else ""))
+                except Exception as e:
+                    log(f'Could not rename "{channel.name}" into "{name}":', repr(e))
+        finally:
+            del self.tasks[channel_id]
+
+
+
+renamer = ChannelRenamer(CHANNEL_RENAME_LIMIT, CHANNEL_RENAME_PERIOD)
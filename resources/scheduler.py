@@ -0,0 +1,108 @@
+from typing import Callable, Coroutine, Hashable, Optional
+from resources.utils import log
+import asyncio
+import heapq
+import itertools
+import time
+
+
+class Scheduler:
+    """Run callbacks at given deadlines from a single task.
+
+    Pending callbacks are kept in a heap ordered by deadline. Cancelling only forgets the entry,
+    its heap item is skipped when it comes out, so scheduling and cancelling are both O(log n)."""
+
+    def __init__(self, name: str, clock: Callable[[], float] = time.time):
+        self.name = name
+        self.clock = clock
+        """Returns the current timestamp, deadlines are compared to it"""
+
+        self.heap: list[tuple[float, int, Hashable]] = []
+        self.entries: dict[Hashable, tuple[float, int, Callable[[], Coroutine]]] = {}
+        """Deadline, sequence number and callback of each pending key"""
+        self.counter = itertools.count()
+        self.wakeup = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.entries
+
+
+    def schedule(self, key: Hashable, deadline: float, callback: Callable[[], Coroutine]):
+        """Call a coroutine function at a timestamp, replacing what was scheduled for the same key"""
+
+        seq = next(self.counter)
+        self.entries[key] = (deadline, seq, callback)
+        heapq.heappush(self.heap, (deadline, seq, key))
+
+        if self.heap[0][1] == seq:
+            # New earliest deadline
+            self.wakeup.set()
+
+        # Drop the cancelled items once they outnumber the pending ones
+        if len(self.heap) > 2 * len(self.entries) + 64:
+            self.heap = [(deadline, seq, key) for key, (deadline, seq, _) in self.entries.items()]
+            heapq.heapify(self.heap)
+
+
+    def cancel(self, key: Hashable) -> bool:
+        """Cancel what was scheduled for a key. Return whether something was pending"""
+        return self.entries.pop(key, None) is not None
+
+
+    def deadline(self, key: Hashable) -> Optional[float]:
+        if key in self.entries:
+            return self.entries[key][0]
+
+
+    def pop_due(self) -> list[tuple[Hashable, Callable[[], Coroutine]]]:
+        """Remove and return the `(key, callback)` whose deadline has passed, the earliest first"""
+
+        now = self.clock()
+        due = []
+
+        while self.heap and self.heap[0][0] <= now:
+            deadline, seq, key = heapq.heappop(self.heap)
+            entry = self.entries.get(key)
+            if entry and entry[1] == seq:
+                del self.entries[key]
+                due.append((key, entry[2]))
+
+        return due
+
+
+    async def call(self, key: Hashable, callback: Callable[[], Coroutine]):
+        try:
+            await callback()
+        except Exception as e:
+            log(f"{self.name} callback for {key} failed:", repr(e))
+
+
+    async def run(self):
+        while True:
+            self.wakeup.clear()
+            for key, callback in self.pop_due():
+                asyncio.create_task(self.call(key, callback))
+
+            timeout = max(0, self.heap[0][0] - self.clock()) if self.heap else None
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        self.task = loop.create_task(self.run())
+
+
+    def stop(self):
+        """Stop the task, the pending callbacks are kept"""
+
+        if self.task:
+            self.task.cancel()
+            self.task = None
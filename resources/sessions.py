@@ -0,0 +1,206 @@
+from data.config import SESSIONS_DB_COLLECTION, SESSIONS_ROLLUP_COLLECTION, SESSIONS_FLUSH_TIMER
+from resources.database import AsyncCollection, buffers, create_time_series, get_collection
+from resources.utils import log
+from typing import Optional
+from collections import defaultdict
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+import datetime as dt
+import asyncio
+
+
+def split_days(start: dt.datetime, end: dt.datetime) -> list[tuple[dt.datetime, float]]:
+    """Split a session into `(day, hours)` parts, one per UTC day it covers"""
+
+    parts = []
+    day = dt.datetime.combine(start.date(), dt.time())
+
+    while day < end:
+        next_day = day + dt.timedelta(days=1)
+        parts.append((day, (min(end, next_day) - max(start, day)) / dt.timedelta(hours=1)))
+        day = next_day
+
+    return parts
+
+
+
+class SessionLedger:
+    """Append-only record of voice sessions, with daily totals per member and channel.
+
+    Sessions go to a time series collection. Each one is also added to the daily rollups with `$inc`,
+    so history, daily activity and channel usage are read from a few small indexed documents."""
+
+    def __init__(self, sessions: AsyncCollection, rollups: AsyncCollection, interval: dt.timedelta):
+        self.sessions = sessions
+        """`{start, end, hours, meta: {member, channel}}` documents"""
+        self.rollups = rollups
+        """`{day, member, channel, hours, sessions}` documents"""
+        self.interval = interval.total_seconds()
+
+        self.pending: list[dict] = []
+        """Sessions waiting to be written"""
+        self.totals: dict[tuple[dt.datetime, int, int], list] = {}
+        """`[hours, sessions]` per `(day, member, channel)` of the sessions written, waiting to be added to the rollups"""
+        self.lock = asyncio.Lock()
+        self.task: Optional[asyncio.Task] = None
+        self.written = 0
+
+
+    async def setup(self):
+        await create_time_series(self.sessions.name, "start", "meta")
+        await self.sessions.create_index([("meta.member", 1), ("start", 1)])
+        await self.sessions.create_index([("meta.channel", 1), ("start", 1)])
+        await self.rollups.create_index([("member", 1), ("day", 1), ("channel", 1)], unique=True)
+        await self.rollups.create_index([("day", 1)])
+        await self.rollups.create_index([("channel", 1), ("day", 1)])
+
+
+    def record(self, member_id: int, channel_id: int, start: dt.datetime, end: dt.datetime):
+        """Queue a session (naive UTC datetimes) to be written with the next flush"""
+
+        if end > start:
+            self.pending.append({
+                "start": start,
+                "end": end,
+                "hours": (end - start) / dt.timedelta(hours=1),
+                "meta": {"member": member_id, "channel": channel_id}
+            })
+
+
+    def add_totals(self, totals: dict[tuple[dt.datetime, int, int], list]):
+        """Queue daily totals to be added to the rollups"""
+
+        for key, (hours, count) in totals.items():
+            total = self.totals.setdefault(key, [0.0, 0])
+            total[0] += hours
+            total[1] += count
+
+
+    async def flush(self):
+        """Insert the pending sessions and add them to the rollups, one request each.
+        Totals which could not be added by a previous flush are added with them"""
+
+        async with self.lock:
+            if self.pending:
+                batch, self.pending = self.pending, []
+                totals = defaultdict(lambda: [0.0, 0])
+
+                for session in batch:
+                    for i, (day, hours) in enumerate(split_days(session["start"], session["end"])):
+                        total = totals[(day, session["meta"]["member"], session["meta"]["channel"])]
+                        total[0] += hours
+                        total[1] += i == 0  # A session is counted on the day it started
+
+                try:
+                    await self.sessions.insert_many(batch, ordered=False)
+                except:
+                    self.pending = batch + self.pending
+                    raise
+
+                self.add_totals(totals)
+                self.written += len(batch)
+
+            if not self.totals:
+                return
+
+            # The sessions are already stored, totals which could not be added are tried again with the next flush
+            totals, self.totals = self.totals, {}
+            try:
+                await self.rollups.bulk_write([
+                    UpdateOne({"day": day, "member": member, "channel": channel}, {"$inc": {"hours": hours, "sessions": count}}, upsert=True)
+                    for (day, member, channel), (hours, count) in totals.items()
+                ], ordered=False)
+            except BulkWriteError as e:
+                # The other updates were applied, adding them again would count them twice
+                keys = list(totals)
+                self.add_totals({keys[error["index"]]: totals[keys[error["index"]]] for error in e.details["writeErrors"]})
+                raise
+            except:
+                self.add_totals(totals)
+                raise
+
+
+    async def try_flush(self) -> bool:
+        """Flush and log the failure if any, the sessions stay pending for the next flush. Return whether it succeeded"""
+
+        try:
+            await self.flush()
+            return True
+        except Exception as e:
+            log("Voice sessions flush failed:", repr(e))
+            return False
+
+
+    async def flush_loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.try_flush()
+
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        """Begin the periodic flushes, unless they are already running.
+        The ledger outlives the cogs using it, a reloaded cog calls this again"""
+
+        if self not in buffers:
+            buffers.append(self)
+        if not self.task or self.task.done():
+            self.task = loop.create_task(self.flush_loop())
+
+
+    async def close(self):
+        """Stop the periodic flushes and write what is left, when the bot shuts down"""
+
+        task, self.task = self.task, None
+        if task:
+            task.cancel()
+        await self.flush()
+
+        if self in buffers:
+            buffers.remove(self)
+
+
+    # - - - - Queries - - - -
+
+    async def member_history(self, member_id: int, since: dt.datetime) -> list[dict]:
+        """Daily `{day, hours, sessions}` of a member"""
+
+        return await self.rollups.aggregate([
+            {"$match": {"member": member_id, "day": {"$gte": since}}},
+            {"$group": {"_id": "$day", "hours": {"$sum": "$hours"}, "sessions": {"$sum": "$sessions"}}},
+            {"$sort": {"_id": 1}}
+        ])
+
+
+    async def daily_activity(self, since: dt.datetime) -> list[dict]:
+        """Daily `{day, hours, members}` of the whole server"""
+
+        return await self.rollups.aggregate([
+            {"$match": {"day": {"$gte": since}}},
+            {"$group": {"_id": "$day", "hours": {"$sum": "$hours"}, "members": {"$addToSet": "$member"}}},
+            {"$project": {"hours": 1, "members": {"$size": "$members"}}},
+            {"$sort": {"_id": 1}}
+        ])
+
+
+    async def channel_usage(self, since: dt.datetime) -> list[dict]:
+        """`{channel, hours, sessions}` of each channel, the most used first"""
+
+        return await self.rollups.aggregate([
+            {"$match": {"day": {"$gte": since}}},
+            {"$group": {"_id": "$channel", "hours": {"$sum": "$hours"}, "sessions": {"$sum": "$sessions"}}},
+            {"$sort": {"hours": -1}}
+        ])
+
+
+    async def hours_between(self, member_id: int, start: dt.datetime, end: dt.datetime) -> float:
+        """Hours a member spent in voice between two day boundaries, such as the hyperactive week"""
+
+        result = await self.rollups.aggregate([
+            {"$match": {"member": member_id, "day": {"$gte": start, "$lt": end}}},
+            {"$group": {"_id": None, "hours": {"$sum": "$hours"}}}
+        ])
+        return result[0]["hours"] if result else 0.0
+
+
+
+ledger = SessionLedger(get_collection(SESSIONS_DB_COLLECTION), get_collection(SESSIONS_ROLLUP_COLLECTION), SESSIONS_FLUSH_TIMER)
@@ -0,0 +1,137 @@
+from typing import Callable, Optional
+from discord import Guild, Member
+import asyncio
+import random
+import os
+
+
+class StatusFile:
+    """Lines of a status file, read again only when the file is modified.
+    They are drawn in a shuffled order, and every line is used once before the order is shuffled again."""
+
+    def __init__(self, path: str, rng: random.Random):
+        self.path = path
+        self.rng = rng
+        self.mtime: Optional[int] = None
+        self.lines: list[str] = []
+        self.schedule: list[str] = []
+        """Next lines to draw, the next one at the end"""
+        self.last: Optional[str] = None
+
+
+    def refresh(self):
+        """Reload the file if it changed since it was read. Blocking, called from a thread by `StatusRotation.refresh()`"""
+
+        mtime = os.stat(self.path).st_mtime_ns
+        if mtime != self.mtime:
+            with open(self.path, encoding="utf-8") as file:
+                self.lines = [line for line in file.read().splitlines() if line.strip()]
+            self.mtime = mtime
+            self.schedule = []
+
+
+    def next(self) -> Optional[str]:
+        if not self.schedule:
+            self.schedule = self.lines.copy()
+            self.rng.shuffle(self.schedule)
+            # Don't show the same line twice in a row across two rounds
+            if len(self.schedule) > 1 and self.schedule[-1] == self.last:
+                self.schedule[0], self.schedule[-1] = self.schedule[-1], self.schedule[0]
+
+        if self.schedule:
+            self.last = self.schedule.pop()
+            return self.last
+
+
+
+class MemberSample:
+    """IDs of the human members of a guild, kept up to date with member events, to draw one without scanning the guild"""
+
+    def __init__(self, rng: random.Random):
+        self.rng = rng
+        self.ids: list[int] = []
+        self.positions: dict[int, int] = {}
+        """Index of each member in `ids`"""
+        self.filled = False
+
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+
+    def fill(self, guild: Guild):
+        self.ids = [member.id for member in guild.members if not member.bot]
+        self.positions = {id: i for i, id in enumerate(self.ids)}
+        self.filled = True
+
+
+    def add(self, member_id: int):
+        if member_id not in self.positions:
+            self.positions[member_id] = len(self.ids)
+            self.ids.append(member_id)
+
+
+    def remove(self, member_id: int):
+        """Swap the member with the last one and drop it, in constant time"""
+
+        i = self.positions.pop(member_id, None)
+        if i is None:
+            return
+
+        last = self.ids.pop()
+        if last != member_id:
+            self.ids[i] = last
+            self.positions[last] = i
+
+
+    def choice(self, guild: Guild) -> Optional[Member]:
+        """A random member still in the guild"""
+
+        while self.ids:
+            member_id = self.rng.choice(self.ids)
+            if member := guild.get_member(member_id):
+                return member
+            # Left while the sample wasn't listening
+            self.remove(member_id)
+
+
+
+class StatusRotation:
+    """Cycle through the kinds of status, each one giving its next text.
+    Kept at module level so that the rotation continues where it was when the cog is reloaded."""
+
+    def __init__(self):
+        self.rng = random.Random()
+        self.files: dict[str, StatusFile] = {}
+        self.members = MemberSample(self.rng)
+        self.step = 0
+
+
+    def file(self, path: str) -> StatusFile:
+        if path not in self.files:
+            self.files[path] = StatusFile(path, self.rng)
+        return self.files[path]
+
+
+    def refresh_files(self):
+        for file in self.files.values():
+            file.refresh()
+
+
+    async def refresh(self):
+        """Reload the modified files in a thread, so the event loop never waits on the disk"""
+        await asyncio.to_thread(self.refresh_files)
+
+
+    def next(self, kinds: list[tuple[int, Callable[[], Optional[str]]]]) -> tuple[int, str]:
+        """Return the `(activity type, text)` of the next status, skipping the kinds without any text"""
+
+        for _ in range(len(kinds)):
+            activity_type, text = kinds[self.step % len(kinds)]
+            self.step += 1
+            if name := text():
+                return activity_type, name
+
+
+
+rotation = StatusRotation()
@@ -3,6 +3,10 @@ import datetime as dt
 import asyncio
 
 
+process_start = dt.datetime.utcnow()
+"""When the bot process started, in naive UTC like the voice timestamps. Kept when the cogs are reloaded"""
+
+
 def log(*values: object, **kwargs):
     """A rewrite of the print() method to show the date and time"""
     print(dt.datetime.now().strftime('%d/%m %H:%M'), "-", *values, **kwargs)
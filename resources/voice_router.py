@@ -0,0 +1,155 @@
+from data.config import REDIRECT_VOICE_CHANNEL, ROOMS_CATEGORY, MEMBERS_INFOCHANNEL, ONLINES_INFOCHANNEL
+from discord import Bot, Member, VoiceState
+from typing import Callable, Coroutine
+from collections import Counter
+from enum import Flag, auto
+from resources import perf
+import asyncio
+
+
+class Transition(Flag):
+    """What happened in an `on_voice_state_update` event. An event can be several transitions at once"""
+
+    JOIN = auto()
+    """A member connected to a voice channel"""
+    LEAVE = auto()
+    """A member disconnected from voice"""
+    MOVE = auto()
+    """A member went from a voice channel to another"""
+    MUTE_TOGGLE = auto()
+    """A member muted or unmuted themselves, without changing channel"""
+    ENTERED_REDIRECT = auto()
+    ENTERED_ROOM = auto()
+    ENTERED_INFOCHANNEL = auto()
+    """Also produced for bots"""
+    LEFT_REDIRECT = auto()
+    LEFT_ROOM = auto()
+
+
+INFOCHANNELS = (MEMBERS_INFOCHANNEL, ONLINES_INFOCHANNEL)
+NONE = Transition(0)
+
+
+class VoiceEvent:
+    def __init__(self, member: Member, before: VoiceState, after: VoiceState, kinds: Transition):
+        self.member = member
+        self.before = before
+        self.after = after
+        self.kinds = kinds
+        """Every transition of the event"""
+
+
+def in_rooms_category(channel) -> bool:
+    return getattr(channel.category, "id", None) == ROOMS_CATEGORY
+
+
+def classify(member: Member, before: VoiceState, after: VoiceState) -> Transition:
+    """Return the transitions of an `on_voice_state_update` event"""
+
+    old, new = before.channel, after.channel
+    kinds = NONE
+
+    if new and new != old and new.id in INFOCHANNELS:
+        kinds |= Transition.ENTERED_INFOCHANNEL
+
+    if member.bot:
+        return kinds
+
+    if old == new:
+        if old and before.self_mute != after.self_mute:
+            kinds |= Transition.MUTE_TOGGLE
+        return kinds
+
+    if not old:
+        kinds |= Transition.JOIN
+    elif not new:
+        kinds |= Transition.LEAVE
+    else:
+        kinds |= Transition.MOVE
+
+    if new:
+        if new.id == REDIRECT_VOICE_CHANNEL:
+            kinds |= Transition.ENTERED_REDIRECT
+        elif in_rooms_category(new):
+            kinds |= Transition.ENTERED_ROOM
+
+    if old:
+        if old.id == REDIRECT_VOICE_CHANNEL:
+            kinds |= Transition.LEFT_REDIRECT
+        elif in_rooms_category(old):
+            kinds |= Transition.LEFT_ROOM
+
+    return kinds
+
+
+
+class Subscription:
+    def __init__(self, kinds: Transition, exclude: Transition, handler: Callable[[VoiceEvent], Coroutine]):
+        self.kinds = kinds
+        self.exclude = exclude
+        self.owner = getattr(handler, "__self__", None)
+        """The cog of the handler, to unsubscribe it when the cog is unloaded"""
+        self.name = handler.__qualname__
+        self.handler = perf.timed(self.name, handler)
+
+
+    def matches(self, kinds: Transition) -> bool:
+        return bool(kinds & self.kinds) and not kinds & self.exclude
+
+
+
+class VoiceRouter:
+    """Classify each `on_voice_state_update` event once, and only call the handlers subscribed to its transitions"""
+
+    def __init__(self):
+        self.bot: Bot = None
+        self.subscriptions: list[Subscription] = []
+        self.counts = Counter()
+        """Number of events dispatched by transition name"""
+
+
+    def attach(self, bot: Bot):
+        """Register the router as the bot's voice state listener"""
+
+        self.bot = bot
+        bot.add_listener(self.dispatch, "on_voice_state_update")
+
+
+    def subscribe(self, kinds: Transition, handler: Callable[[VoiceEvent], Coroutine], exclude: Transition = NONE):
+        """Call a handler for events with any of the given transitions, unless they also have one of `exclude`"""
+        self.subscriptions.append(Subscription(kinds, exclude, handler))
+
+
+    def unsubscribe(self, owner: object):
+        """Remove every subscription of a cog"""
+        self.subscriptions = [s for s in self.subscriptions if s.owner is not owner]
+
+
+    def route(self, member: Member, before: VoiceState, after: VoiceState) -> tuple[VoiceEvent, list[Subscription]]:
+        """Classify an event and return the subscriptions it must be dispatched to"""
+
+        kinds = classify(member, before, after)
+
+        for kind in Transition:
+            if kind in kinds:
+                self.counts[kind.name] += 1
+
+        return VoiceEvent(member, before, after, kinds), [s for s in self.subscriptions if s.matches(kinds)]
+
+
+    async def dispatch(self, member: Member, before: VoiceState, after: VoiceState):
+        event, subscriptions = self.route(member, before, after)
+
+        for subscription in subscriptions:
+            asyncio.create_task(self.run(subscription, event))
+
+
+    async def run(self, subscription: Subscription, event: VoiceEvent):
+        try:
+            await subscription.handler(event)
+        except Exception:
+            await self.bot.on_error("on_voice_state_update", event.member, event.before, event.after)
+
+
+
+router = VoiceRouter()
@@ -1,17 +1,74 @@
-import discord, datetime, traceback, sys, io, dotenv, os
+from time import perf_counter
+process_start = perf_counter()
+
+import discord, datetime, traceback, sys, io, dotenv, os, asyncio, importlib
 from discord.ext import commands
 from data.config import BOT_EXTENSIONS, BOT_GUILDS, CONSOLE_CHANNEL, OWNER_ID
+from resources.voice_router import router
+from resources import perf
+from typing import Awaitable
 
+perf.startup["main imports"] = perf_counter() - process_start
+
+
+def preload_extensions():
+    """Import the extensions and their dependencies, so that loading them afterwards only runs their own module"""
+
+    for extension in BOT_EXTENSIONS:
+        with perf.phase(f"import {extension}"):
+            importlib.import_module(f"cogs.{extension}")
+
+
+async def timed(name: str, awaitable: Awaitable):
+    with perf.phase(name):
+        return await awaitable
+
+
+class TavernierBot(commands.Bot):
+    def add_cog(self, cog: commands.Cog, *, override: bool = False):
+        # Time every listener to find the slow ones with /perf
+        perf.instrument(cog)
+        super().add_cog(cog, override=override)
+
+
+    async def invoke_application_command(self, ctx: discord.ApplicationContext):
+        await perf.timed_command(ctx, super().invoke_application_command)
 
-intents = discord.Intents.all()
-bot = commands.Bot(intents=intents, debug_guilds=BOT_GUILDS)
 
+    async def close(self):
+        # Imported here so that pymongo is only imported with the extensions, while logging in
+        from resources.database import flush_all
 
-print("Loading cogs...")
-for extension in BOT_EXTENSIONS:
-    # Load the extensions
-    bot.load_extension(f"cogs.{extension}")
-print("- - -")
+        # Write the pending database updates before disconnecting, the bot disconnects even if it fails
+        try:
+            await flush_all()
+        finally:
+            await super().close()
+
+
+    async def prepare(self, login: Awaitable):
+        """Import the extensions in a thread while logging in, then load them before connecting to the gateway"""
+
+        with perf.phase("login + imports"):
+            await asyncio.gather(timed("login", login), asyncio.to_thread(preload_extensions))
+
+        print("Loading cogs...")
+        with perf.phase("extensions"):
+            for extension in BOT_EXTENSIONS:
+                with perf.phase(f"load {extension}"):
+                    self.load_extension(f"cogs.{extension}")
+        print("- - -")
+
+
+    async def start(self, token: str, *, reconnect: bool = True):
+        await self.prepare(self.login(token))
+        self.connect_start = perf_counter()
+        await self.connect(reconnect=reconnect)
+
+
+intents = discord.Intents.all()
+bot = TavernierBot(intents=intents, debug_guilds=BOT_GUILDS)
+router.attach(bot)
 
 
 @bot.event
@@ -22,6 +79,12 @@ async def on_ready():
     print("Currently running with version", discord.__version__, "of py-cord")
     print('- - -')
 
+    if "ready" not in perf.startup:
+        perf.startup["gateway"] = perf_counter() - bot.connect_start
+        perf.startup["ready"] = perf_counter() - process_start
+        print(perf.startup_report())
+        print('- - -')
+
 
 @bot.event
 async def on_error(source, *args, **kwargs):
@@ -31,9 +94,10 @@ async def on_error(source, *args, **kwargs):
     await output.send(file=discord.File(file, "traceback.txt"))
 
 
-# Private .env file
-dotenv.load_dotenv()
-bot_token = os.getenv("TOKEN")
+if __name__ == "__main__":
+    # Private .env file
+    dotenv.load_dotenv()
+    bot_token = os.getenv("TOKEN")
 
-# Discord connection
-bot.run(bot_token)
\ No newline at end of file
+    # Discord connection
+    bot.run(bot_token)
\ No newline at end of file
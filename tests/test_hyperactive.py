@@ -0,0 +1,85 @@
+from resources.member_cache import MemberCache
+from resources.database import WriteBuffer, get_collection
+from datetime import datetime, timedelta
+import cogs.hyperactive as hyperactive
+import pytest
+
+
+BOUNDARY = datetime(2024, 1, 8)  # A Monday
+END = BOUNDARY.timestamp()
+HOUR = 3600
+WEEK = 7 * 24 * HOUR
+
+
+@pytest.fixture
+def cache(monkeypatch) -> MemberCache:
+    """An empty member cache and write buffer in place of the cog's, nothing is sent to the database"""
+
+    cache = MemberCache()
+    monkeypatch.setattr(hyperactive, "cache", cache)
+    monkeypatch.setattr(hyperactive, "buffer", WriteBuffer(get_collection("test"), timedelta(hours=1), 10**6))
+    return cache
+
+
+def test_level_of_the_week_and_new_week(cache):
+    cache.set(1, level=0, time=1.5, last=END - 2 * HOUR)
+    cache.set(2, level=2, time=0.5, last=END - 2 * HOUR)
+
+    _, levels = hyperactive.reset_week(BOUNDARY, {}, 10)
+
+    assert levels == {1: 1, 2: 1}
+    # The last activity is moved to the boundary, so the next reset only counts the week after it
+    assert cache.get(1) == (1, 0, END)
+    assert hyperactive.buffer.get(2) == {"level": 1, "time": 0, "last": END}
+
+
+def test_members_without_time_lose_a_level_per_idle_week(cache):
+    cache.set(1, level=4, time=0, last=END - 3 * WEEK - HOUR)
+    # Already reset at the previous boundary, and no activity since
+    cache.set(2, level=3, time=0, last=END - WEEK)
+    # Some time, but the last activity is more than 2 weeks old
+    cache.set(3, level=4, time=2, last=END - 2 * WEEK - HOUR)
+    cache.set(4, level=0, time=0, last=END - 5 * WEEK)
+
+    _, levels = hyperactive.reset_week(BOUNDARY, {}, 10)
+
+    assert levels == {1: 1, 2: 2, 3: 2}
+    assert cache.get(4) == (0, 0, END - 5 * WEEK)
+
+
+def test_members_in_voice_have_their_time_split(cache):
+    # Joined half an hour before the boundary, with 45 minutes of earlier sessions
+    cache.set(1, level=0, time=0.75, last=END - HOUR / 2)
+    # Without the half hour before the boundary, 30 minutes would not keep the level 2
+    cache.set(2, level=2, time=0.5, last=END - HOUR / 2)
+
+    rankings, levels = hyperactive.reset_week(BOUNDARY, {1: 100, 2: 100}, 10)
+
+    assert levels == {1: 1, 2: 2}
+    assert cache.get(1) == (1, 0, END)
+    assert [[(data.member_id, data.time) for data in rank] for rank in rankings] == [[(1, timedelta(hours=1.25))], [(2, timedelta(hours=1))]]
+
+
+def test_members_already_in_the_new_week_are_left_out(cache):
+    cache.set(1, level=2, time=0.5, last=END + HOUR)
+    cache.set(2, level=1, time=3, last=END - HOUR)
+
+    rankings, levels = hyperactive.reset_week(BOUNDARY, {1: 100}, 10)
+
+    assert cache.get(1) == (2, 0.5, END + HOUR)
+    assert 1 not in levels
+    assert [[data.member_id for data in rank] for rank in rankings] == [[2]]
+
+
+def test_rankings_of_the_week(cache):
+    cache.set(1, level=0, time=2, last=END - HOUR)
+    cache.set(2, level=0, time=3, last=END - HOUR)
+    cache.set(3, level=0, time=2, last=END - 2 * HOUR)
+    # Too long ago to be ranked this week
+    cache.set(4, level=0, time=5, last=END - WEEK - HOUR)
+
+    rankings, _ = hyperactive.reset_week(BOUNDARY, {}, 2)
+
+    assert [sorted(data.member_id for data in rank) for rank in rankings] == [[2], [1, 3]]
+    # Ranked with the level they have after the reset
+    assert [data.level for data in rankings[0]] == [1]
@@ -0,0 +1,151 @@
+from resources.renamer import ChannelRenamer
+from datetime import timedelta
+import asyncio
+import inspect
+
+
+class FakeChannel:
+    def __init__(self, id: int, name: str):
+        self.id = id
+        self.name = name
+
+
+class FakeRest:
+    """Stands for the REST client: records the edits and when they were made, on the fake clock"""
+
+    def __init__(self, clock: "FakeClock"):
+        self.clock = clock
+        self.edits: list[tuple[float, int, str]] = []
+        self.blocked: asyncio.Event = None
+        """If set, edits wait for it, like a request stuck on a 429"""
+
+    async def edit(self, channel: FakeChannel, name: str, reason):
+        if self.blocked:
+            await self.blocked.wait()
+        self.edits.append((self.clock.now, channel.id, name))
+        channel.name = name
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    async def sleep(self, seconds: float):
+        self.now += seconds
+        await asyncio.sleep(0)
+
+
+def make_renamer() -> tuple[ChannelRenamer, FakeClock, FakeRest]:
+    clock = FakeClock()
+    rest = FakeRest(clock)
+    renamer = ChannelRenamer(2, timedelta(minutes=10), clock=clock, sleep=clock.sleep, edit=rest.edit)
+    return renamer, clock, rest
+
+
+async def settle(renamer: ChannelRenamer):
+    """Wait until every pending rename has been applied"""
+    while renamer.tasks:
+        await asyncio.gather(*renamer.tasks.values())
+
+
+def test_budget_of_two_renames_per_ten_minutes():
+    async def scenario():
+        renamer, clock, rest = make_renamer()
+        channel = FakeChannel(1, "start")
+
+        for name in ["a", "b", "c", "d"]:
+            renamer.rename(channel, name)
+            await settle(renamer)
+
+        return rest.edits
+
+    edits = asyncio.run(scenario())
+    assert [time for time, _, _ in edits] == [0, 0, 600, 600]
+    assert [name for _, _, name in edits] == ["a", "b", "c", "d"]
+
+
+def test_budget_is_per_channel():
+    async def scenario():
+        renamer, clock, rest = make_renamer()
+        first, second = FakeChannel(1, "first"), FakeChannel(2, "second")
+
+        for name in ["a", "b"]:
+            renamer.rename(first, name)
+            await settle(renamer)
+        renamer.rename(second, "c")
+        await settle(renamer)
+
+        return rest.edits
+
+    assert asyncio.run(scenario())[-1] == (0, 2, "c")
+
+
+def test_only_the_latest_name_is_applied():
+    async def scenario():
+        renamer, clock, rest = make_renamer()
+        channel = FakeChannel(1, "start")
+
+        # Use up the budget, then request several names while the channel is rate limited
+        for name in ["a", "b"]:
+            renamer.rename(channel, name)
+            await settle(renamer)
+        for name in ["c", "d", "e"]:
+            renamer.rename(channel, name)
+        await settle(renamer)
+
+        return renamer, rest.edits
+
+    renamer, edits = asyncio.run(scenario())
+    assert edits[2:] == [(600, 1, "e")]
+    assert renamer.coalesced == 2
+    assert renamer.applied == 3
+
+
+def test_no_op_renames_are_skipped():
+    async def scenario():
+        renamer, clock, rest = make_renamer()
+        channel = FakeChannel(1, "start")
+
+        # Already the channel's name
+        renamer.rename(channel, "start")
+        assert not renamer.tasks
+
+        # Back to the current name before the pending one could be applied
+        for name in ["a", "b"]:
+            renamer.rename(channel, name)
+            await settle(renamer)
+        renamer.rename(channel, "c")
+        renamer.rename(channel, "b")
+        await settle(renamer)
+
+        return renamer, rest.edits
+
+    renamer, edits = asyncio.run(scenario())
+    assert [name for _, _, name in edits] == ["a", "b"]
+    assert renamer.skipped == 2
+
+
+def test_rename_never_waits():
+    async def scenario():
+        renamer, clock, rest = make_renamer()
+        rest.blocked = asyncio.Event()
+        channel = FakeChannel(1, "start")
+
+        # The edit of "a" starts and gets stuck
+        renamer.rename(channel, "a")
+        await asyncio.sleep(0)
+
+        # Requesting more names still returns right away
+        for name in ["b", "c"]:
+            assert renamer.rename(channel, name) is None
+        assert rest.edits == []
+
+        rest.blocked.set()
+        await settle(renamer)
+        return rest.edits
+
+    assert not inspect.iscoroutinefunction(ChannelRenamer.rename)
+    assert [name for _, _, name in asyncio.run(scenario())] == ["a", "c"]
@@ -0,0 +1,102 @@
+from resources.scheduler import Scheduler
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+async def callback():
+    pass
+
+
+def make_scheduler() -> tuple[Scheduler, FakeClock]:
+    clock = FakeClock()
+    return Scheduler("Test", clock=clock), clock
+
+
+def due_keys(scheduler: Scheduler) -> list:
+    return [key for key, _ in scheduler.pop_due()]
+
+
+def test_callbacks_come_out_earliest_first():
+    scheduler, clock = make_scheduler()
+
+    for key, deadline in [("c", 30), ("a", 10), ("d", 40), ("b", 20)]:
+        scheduler.schedule(key, deadline, callback)
+
+    clock.now = 25
+    assert due_keys(scheduler) == ["a", "b"]
+    assert due_keys(scheduler) == []
+
+    clock.now = 40
+    assert due_keys(scheduler) == ["c", "d"]
+    assert len(scheduler) == 0
+
+
+def test_rescheduling_replaces_the_deadline():
+    scheduler, clock = make_scheduler()
+
+    scheduler.schedule("a", 10, callback)
+    scheduler.schedule("a", 50, callback)
+    assert scheduler.deadline("a") == 50
+
+    # The old deadline passes without firing
+    clock.now = 20
+    assert due_keys(scheduler) == []
+
+    # And an earlier deadline replaces a later one
+    scheduler.schedule("a", 15, callback)
+    assert due_keys(scheduler) == ["a"]
+
+    clock.now = 60
+    assert due_keys(scheduler) == []
+
+
+def test_only_the_latest_callback_of_a_key_is_returned():
+    scheduler, clock = make_scheduler()
+
+    async def first():
+        pass
+
+    async def second():
+        pass
+
+    scheduler.schedule("a", 10, first)
+    scheduler.schedule("a", 10, second)
+
+    clock.now = 10
+    assert scheduler.pop_due() == [("a", second)]
+
+
+def test_cancelled_keys_never_fire():
+    scheduler, clock = make_scheduler()
+
+    scheduler.schedule("a", 10, callback)
+    scheduler.schedule("b", 20, callback)
+    assert scheduler.cancel("a")
+    assert not scheduler.cancel("a")
+    assert "a" not in scheduler
+
+    clock.now = 30
+    assert due_keys(scheduler) == ["b"]
+
+
+def test_heap_is_compacted():
+    scheduler, clock = make_scheduler()
+
+    for i in range(1000):
+        scheduler.schedule(i % 10, 100 + i, callback)
+        if i % 10 == 9:
+            scheduler.cancel(i % 7)
+
+    # Every replaced or cancelled item would still be in the heap without the compaction
+    assert len(scheduler.heap) < 100
+    pending = sorted(scheduler.entries, key=scheduler.deadline)
+
+    clock.now = 2000
+    assert due_keys(scheduler) == pending
+    assert scheduler.heap == []